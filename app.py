@@ -1,25 +1,46 @@
 import os
 import duckdb
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
 import time
 import threading
+import queue
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, after_this_request, Response
+from flask.json.provider import DefaultJSONProvider
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-import csv
-import io
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 import zipfile
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+import tempfile
+import shutil
+import uuid
+from zipstream import ZipStream
+import xlsxwriter
 import re
 
 # Load environment variables
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify skips the stdlib encoder."""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
 
 # API configuration
@@ -27,6 +48,10 @@ API_PROVIDER = os.getenv('API_PROVIDER', 'viewdns')
 VIEWDNS_API_KEY = os.getenv('VIEWDNS_API_KEY')
 SECURITYTRAILS_API_KEY = os.getenv('SECURITYTRAILS_API_KEY')
 
+# ViewDNS harvesting throughput (requests per second shared by all workers, pages fetched ahead)
+VIEWDNS_RATE_LIMIT = float(os.getenv('VIEWDNS_RATE_LIMIT', '1'))
+VIEWDNS_PREFETCH_PAGES = int(os.getenv('VIEWDNS_PREFETCH_PAGES', '4'))
+
 # Database configuration
 DATABASE = 'domains.duckdb'
 
@@ -34,56 +59,296 @@ DATABASE = 'domains.duckdb'
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Global variables for tracking harvesting progress
-harvest_progress = {}
-harvest_threads = {}
+# Shared DuckDB connection - opened once, each thread works on its own cursor
+_db_conn = None
+_db_local = threading.local()
+_db_lock = threading.Lock()
+db_write_lock = threading.Lock()
+
+def get_db():
+    """Return the calling thread's cursor on the shared DuckDB connection."""
+    global _db_conn
+    cursor = getattr(_db_local, 'cursor', None)
+    if cursor is None:
+        with _db_lock:
+            if _db_conn is None:
+                _db_conn = duckdb.connect(DATABASE)
+                # Enable optimizations (using correct DuckDB syntax)
+                _db_conn.execute("SET enable_object_cache=true")
+                # Row order is never relied on (queries use ORDER BY) - lets bulk loads run in parallel
+                _db_conn.execute("SET preserve_insertion_order=false")
+                # Harvests checkpoint explicitly when they finish; avoid WAL-size checkpoints mid-session
+                _db_conn.execute("SET checkpoint_threshold='256MB'")
+        cursor = _db_conn.cursor()
+        _db_local.cursor = cursor
+    return cursor
+
+def get_autocommit_db():
+    """Return the calling thread's second cursor, for short writes that commit on their own.
+    
+    A harvest keeps a transaction open on its get_db() cursor for several pages;
+    shared rows (server counters) written there would conflict with a concurrent
+    harvest of the same server at COMMIT, so they go through this cursor instead.
+    """
+    cursor = getattr(_db_local, 'autocommit_cursor', None)
+    if cursor is None:
+        get_db()
+        cursor = _db_conn.cursor()
+        _db_local.autocommit_cursor = cursor
+    return cursor
+
+def create_domains_table(conn, table_name='domains'):
+    """Create the domains table (no surrogate key - rows are addressed by domain/mx/ns)."""
+    conn.execute(f'''
+        CREATE TABLE {table_name} (
+            domain VARCHAR NOT NULL,
+            mx VARCHAR,
+            ns VARCHAR,
+            provider VARCHAR DEFAULT 'viewdns',
+            session_id VARCHAR,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    if table_name == 'domains':
+        create_domain_indexes(conn)
+
+def create_domain_indexes(conn):
+    """Create optimized indexes on the domains table."""
+    conn.execute("CREATE INDEX idx_domain ON domains(domain)")
+    conn.execute("CREATE INDEX idx_mx ON domains(mx)")
+    conn.execute("CREATE INDEX idx_ns ON domains(ns)")
+    conn.execute("CREATE INDEX idx_provider ON domains(provider)")
+    conn.execute("CREATE INDEX idx_fetched_at ON domains(fetched_at)")
+    conn.execute("CREATE INDEX idx_session_provider ON domains(session_id, provider)")
+
+def create_server_counts_table(conn):
+    """Create the per-server row counters and seed them from the rows already stored.
+    
+    insert_domains_batch keeps them current, so the stats never have to
+    re-aggregate the domains table for totals and top servers.
+    """
+    conn.execute('''
+        CREATE TABLE server_counts (
+            kind VARCHAR NOT NULL,
+            server VARCHAR NOT NULL,
+            provider VARCHAR NOT NULL,
+            n BIGINT NOT NULL,
+            PRIMARY KEY (kind, server, provider)
+        )
+    ''')
+    conn.execute("""
+        INSERT INTO server_counts
+        SELECT 'mx', mx, coalesce(provider, 'Unknown'), COUNT(*) FROM domains WHERE mx IS NOT NULL GROUP BY ALL
+        UNION ALL
+        SELECT 'ns', ns, coalesce(provider, 'Unknown'), COUNT(*) FROM domains WHERE ns IS NOT NULL GROUP BY ALL
+    """)
+
+def create_unique_domains_table(conn):
+    """Create the set of distinct domain names, seeded from the rows already stored.
+    
+    insert_domains_batch adds every harvested name (see add_unique_domains), so the
+    unique-domain stat is a COUNT(*) over this table instead of a distinct count over domains.
+    """
+    conn.execute("CREATE TABLE unique_domains (domain VARCHAR PRIMARY KEY)")
+    conn.execute("INSERT INTO unique_domains SELECT DISTINCT domain FROM domains")
+
+def rebuild_domains_table(conn, order_by=None, domain_sql='domain'):
+    """Copy domains into a freshly created table (optionally sorted) and swap it in with its indexes."""
+    order_sql = f"ORDER BY {order_by}" if order_by else ""
+    
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        create_domains_table(conn, 'domains_rebuilt')
+        conn.execute(f"""
+            INSERT INTO domains_rebuilt (domain, mx, ns, provider, session_id, fetched_at)
+            SELECT {domain_sql}, mx, ns, provider, session_id, fetched_at FROM domains {order_sql}
+        """)
+        conn.execute("DROP TABLE domains")
+        conn.execute("ALTER TABLE domains_rebuilt RENAME TO domains")
+        create_domain_indexes(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def migrate_drop_domain_id(conn):
+    """Rebuild a legacy domains table without its id PRIMARY KEY and sequence."""
+    logger.info("Migrating domains table: dropping legacy id primary key")
+    rebuild_domains_table(conn)
+    conn.execute("DROP SEQUENCE IF EXISTS domains_id_seq")
+
+def migrate_bare_domains(conn):
+    """Rewrite domains stored as http:// URLs to bare hostnames.
+    
+    Older databases kept the prefix on every row, which bloated idx_domain and
+    made example.com and http://example.com distinct keys. The prefix is added
+    back at export time instead.
+    """
+    logger.info("Migrating domains table: stripping stored http:// prefixes")
+    rebuild_domains_table(conn, domain_sql=f"{BARE_DOMAIN_SQL} AS domain")
+    conn.execute("DROP TABLE IF EXISTS unique_domains")
+
+def reorder_domains(conn):
+    """Rewrite domains in export order (fetched_at DESC) - call with db_write_lock held.
+    
+    With rows stored sorted, the zone maps on fetched_at line up with the export
+    ORDER BY, so DuckDB's sort mostly finds already ordered row groups.
+    """
+    rebuild_domains_table(conn, order_by='fetched_at DESC')
+
+def compact_domains_storage(conn):
+    """Checkpoint with dictionary compression forced - call with db_write_lock held.
+    
+    mx/ns/provider hold a handful of distinct servers repeated millions of times, so
+    dictionary encoding shrinks what the stats and export scans have to read.
+    Statistics are refreshed too, so the planner sees the new distinct counts.
+    """
+    try:
+        conn.execute("PRAGMA force_compression='dictionary'")
+        conn.execute("CHECKPOINT")
+        conn.execute("ANALYZE domains")
+    finally:
+        conn.execute("PRAGMA force_compression='auto'")
+
+def maintain_domains_storage(conn=None):
+    """Reorder and compact the domains table unless a harvest is running.
+    
+    The rebuild swaps in a new table, which would silently drop rows a harvest
+    has written in a transaction that is still open. harvest_lock is held
+    throughout, and the /harvest route creates and registers sessions under it,
+    so no harvest can start meanwhile.
+    
+    Returns False (and does nothing) while any harvest thread is alive.
+    """
+    if conn is None:
+        conn = get_db()
+    
+    with harvest_lock:
+        if any(thread.is_alive() for thread in harvest_threads.values()):
+            return False
+        
+        with db_write_lock:
+            reorder_domains(conn)
+            compact_domains_storage(conn)
+    
+    invalidate_stats_cache()
+    return True
+
+def checkpoint_database(conn=None):
+    """Fold the WAL into the main database file."""
+    if conn is None:
+        conn = get_db()
+    
+    with db_write_lock:
+        try:
+            conn.execute("CHECKPOINT")
+        except Exception as e:
+            logger.warning(f"Could not checkpoint database: {e}")
+
+# Harvest pages written per transaction, and the longest a transaction stays open
+PAGES_PER_TRANSACTION = 10
+TRANSACTION_MAX_SECONDS = 5
+
+class BatchedTransaction:
+    """Group writes on one cursor into a transaction per `size` steps (or `max_age` seconds).
+    
+    Committed when the block exits cleanly and rolled back when it raises. A failed
+    COMMIT is rolled back and re-raised, so the caller sees the lost writes as an
+    error instead of carrying on with totals that include them. Callbacks queued
+    with after_commit run once the writes they describe are committed, and are
+    dropped with them on rollback.
+    """
+    
+    def __init__(self, conn, size, max_age=None):
+        self.conn = conn
+        self.size = size
+        self.max_age = max_age
+        self.steps = 0
+        self.started = time.monotonic()
+        self.pending = []
+    
+    def __enter__(self):
+        self.conn.execute("BEGIN TRANSACTION")
+        self.started = time.monotonic()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+    
+    def step(self):
+        """Count one unit of work, committing and starting afresh every `size` steps."""
+        self.steps += 1
+        expired = self.max_age is not None and time.monotonic() - self.started >= self.max_age
+        if self.steps >= self.size or expired:
+            self.commit()
+            self.conn.execute("BEGIN TRANSACTION")
+            self.started = time.monotonic()
+    
+    def after_commit(self, callback):
+        """Run `callback` after the open transaction commits (never, if it rolls back)."""
+        self.pending.append(callback)
+    
+    def commit(self):
+        self.steps = 0
+        try:
+            self.conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Transaction commit failed: {e}")
+            self.rollback()
+            raise
+        
+        pending, self.pending = self.pending, []
+        for callback in pending:
+            callback()
+    
+    def rollback(self):
+        self.steps = 0
+        self.pending = []
+        try:
+            self.conn.execute("ROLLBACK")
+        except Exception:
+            pass
 
 def init_db():
     """Initialize the DuckDB database with enhanced schema for provider tracking."""
-    conn = duckdb.connect(DATABASE)
+    conn = get_db()
     
-    # Enable optimizations (using correct DuckDB syntax)
-    conn.execute("SET enable_object_cache=true")
+    # One catalog read tells which tables exist and which columns domains has
+    columns = defaultdict(set)
+    for table_name, column_name in conn.execute(
+        "SELECT table_name, column_name FROM information_schema.columns"
+    ).fetchall():
+        columns[table_name].add(column_name)
     
-    # Check if domains table exists
-    try:
-        result = conn.execute("SELECT COUNT(*) FROM domains").fetchone()
-        table_exists = True
-    except:
-        table_exists = False
+    # Staging tables of exports killed mid-way (the normal path drops its own)
+    for table_name in columns:
+        if table_name.startswith(EXPORT_ROWS_PREFIX):
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
     
-    if not table_exists:
+    if 'domains' not in columns:
         # Create domains table with optimized types
-        conn.execute('''
-            CREATE TABLE domains (
-                id BIGINT PRIMARY KEY,
-                domain VARCHAR NOT NULL,
-                mx VARCHAR,
-                ns VARCHAR,
-                provider VARCHAR DEFAULT 'viewdns',
-                session_id VARCHAR,
-                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        create_domains_table(conn)
+    else:
+        # Older databases carry a surrogate id PRIMARY KEY that nothing reads
+        if 'id' in columns['domains']:
+            migrate_drop_domain_id(conn)
         
-        # Create sequence for auto-increment
-        conn.execute("CREATE SEQUENCE domains_id_seq START 1")
+        if conn.execute(
+            "SELECT 1 FROM domains WHERE domain LIKE 'http://%' OR domain LIKE 'https://%' LIMIT 1"
+        ).fetchone():
+            migrate_bare_domains(conn)
+            # unique_domains is reseeded from the rewritten rows below
+            columns.pop('unique_domains', None)
         
-        # Create optimized indexes
-        conn.execute("CREATE INDEX idx_domain ON domains(domain)")
-        conn.execute("CREATE INDEX idx_mx ON domains(mx)")
-        conn.execute("CREATE INDEX idx_ns ON domains(ns)")
-        conn.execute("CREATE INDEX idx_provider ON domains(provider)")
-        conn.execute("CREATE INDEX idx_fetched_at ON domains(fetched_at)")
-    
-    # Check if harvest_sessions table exists
-    try:
-        result = conn.execute("SELECT COUNT(*) FROM harvest_sessions").fetchone()
-        sessions_table_exists = True
-    except:
-        sessions_table_exists = False
+        # Session-scoped lookups (harvest bookkeeping) predate this index on older databases
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_provider ON domains(session_id, provider)")
     
-    if not sessions_table_exists:
+    if 'harvest_sessions' not in columns:
         # Create harvest sessions table
         conn.execute('''
             CREATE TABLE harvest_sessions (
@@ -101,86 +366,273 @@ def init_db():
         
         # Create indexes for harvest sessions
         conn.execute("CREATE INDEX idx_harvest_server ON harvest_sessions(server)")
-        conn.execute("CREATE INDEX idx_harvest_status ON harvest_sessions(status)")
         conn.execute("CREATE INDEX idx_harvest_started ON harvest_sessions(started_at)")
+    else:
+        # DuckDB turns an UPDATE of an indexed column into delete + insert, which trips the
+        # id PRIMARY KEY check - with status indexed, session status updates never persisted
+        conn.execute("DROP INDEX IF EXISTS idx_harvest_status")
+    
+    if 'server_counts' not in columns:
+        create_server_counts_table(conn)
     
-    conn.close()
+    if 'unique_domains' not in columns:
+        create_unique_domains_table(conn)
 
-# Global variables for tracking harvesting progress
-harvest_progress = {}
+# Global variables for tracking harvesting progress - bounded, guarded by harvest_lock
+MAX_TRACKED_HARVESTS = 128
+PROGRESS_RETENTION_SECONDS = 60  # finished sessions stay visible this long
+harvest_progress = OrderedDict()
 harvest_threads = {}
+harvest_lock = threading.Lock()
+
+# Read-only copy of harvest_progress for /progress polling. Writers rebuild it and swap
+# the reference under harvest_lock; entries are replaced, never mutated, so readers need no lock.
+progress_snapshot = {}
+
+def publish_harvest_progress():
+    """Swap in a fresh progress snapshot - call with harvest_lock held."""
+    global progress_snapshot
+    progress_snapshot = dict(harvest_progress)
+
+def set_harvest_progress(session_id, **progress):
+    """Store the latest progress for a session, evicting the oldest once over capacity."""
+    with harvest_lock:
+        harvest_progress[session_id] = progress
+        harvest_progress.move_to_end(session_id)
+        while len(harvest_progress) > MAX_TRACKED_HARVESTS:
+            harvest_progress.popitem(last=False)
+        publish_harvest_progress()
+
+def get_harvest_progress(session_id):
+    """Return the tracked progress for a session (empty if unknown) from the current snapshot."""
+    return progress_snapshot.get(session_id, {})
+
+def forget_harvest(session_id):
+    """Drop progress and thread tracking for a finished session."""
+    with harvest_lock:
+        harvest_progress.pop(session_id, None)
+        harvest_threads.pop(session_id, None)
+        publish_harvest_progress()
+
+# Per-page progress reaches harvest_sessions at most this often; the in-memory entry is always current
+PROGRESS_FLUSH_SECONDS = 2.0
+last_progress_flush = {}  # session_id -> monotonic time of the last row update, guarded by harvest_lock
+
+def record_harvest_progress(session_id, page, total_domains, server, record_type):
+    """Single per-page progress path: the progress entry every page, the session row when due."""
+    now = time.monotonic()
+    with harvest_lock:
+        flush_due = now - last_progress_flush.get(session_id, 0) >= PROGRESS_FLUSH_SECONDS
+        if flush_due:
+            last_progress_flush[session_id] = now
+    
+    if flush_due:
+        update_harvest_session(session_id, pages_fetched=page, total_domains=total_domains)
+    set_harvest_progress(
+        session_id,
+        page=page,
+        total_domains=total_domains,
+        server=server,
+        record_type=record_type
+    )
+
+def finish_harvest(session_id, status, **kwargs):
+    """Mark a session complete/error and schedule its in-memory tracking for removal."""
+    # Terminal states always write, carrying any progress the throttle held back
+    with harvest_lock:
+        last_progress_flush.pop(session_id, None)
+        progress = harvest_progress.get(session_id)
+    if progress is not None and 'page' in progress:
+        kwargs = {'pages_fetched': progress['page'], 'total_domains': progress['total_domains'], **kwargs}
+    update_harvest_session(session_id, status=status, **kwargs)
+    # Final state must be on disk before callers refresh stats
+    session_writer.flush()
+    
+    with harvest_lock:
+        progress = harvest_progress.get(session_id)
+        if progress is not None:
+            harvest_progress[session_id] = {**progress, 'status': status}
+            publish_harvest_progress()
+    
+    cleanup = threading.Timer(PROGRESS_RETENTION_SECONDS, forget_harvest, args=(session_id,))
+    cleanup.daemon = True
+    cleanup.start()
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly at a fixed rate (and can be paused)."""
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+    
+    def wait(self):
+        """Block until the caller's request slot is due."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def pause(self, seconds):
+        """Hold every caller back for `seconds` (e.g. after a 429 with Retry-After)."""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+def looks_like_json(body):
+    """Cheap first-byte check so HTML error pages skip the JSON parser (content-type is not trusted)."""
+    return body[:64].lstrip()[:1] in (b'{', b'[', b'"')
+
+def retry_after_seconds(response, default=5.0):
+    """Seconds to back off from a throttled response's Retry-After header."""
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', default)))
+    except ValueError:
+        # HTTP-date form - not worth parsing, fall back to the default
+        return default
+
+# Fetched pages that may wait for the database before the fetch loop blocks
+HARVEST_QUEUE_PAGES = 8
+
+class HarvestPageWriter:
+    """Dedicated database writer for one harvest.
+    
+    The fetch loop hands (page, domains) pairs over a bounded queue and goes back
+    to the network; this thread inserts them in page-group transactions and
+    records progress. None on the queue marks the end of the harvest.
+    """
+    
+    def __init__(self, record_type, server, session_id, max_queued_pages=HARVEST_QUEUE_PAGES):
+        self.record_type = record_type
+        self.server = server
+        self.session_id = session_id
+        self.queue = queue.Queue(maxsize=max_queued_pages)
+        self.total_domains = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f'harvest-writer-{session_id}', daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def put(self, page, domains):
+        """Queue a fetched page for writing (blocks while the queue is full)."""
+        self.queue.put((page, domains))
+    
+    def close(self):
+        """Mark the end of the harvest and wait until every queued page is written."""
+        self.queue.put(None)
+        self.thread.join()
+    
+    def _run(self):
+        closed = False  # the None sentinel has been consumed
+        try:
+            with BatchedTransaction(get_db(), PAGES_PER_TRANSACTION, TRANSACTION_MAX_SECONDS) as transaction:
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        closed = True
+                        return
+                    
+                    page, domains = item
+                    page_count = insert_domains_batch(
+                        domains, self.record_type, self.server, self.session_id, transaction=transaction
+                    )
+                    self.total_domains += page_count
+                    transaction.step()
+                    
+                    logger.info(f"Page {page}: {page_count} domains, Total: {self.total_domains}")
+                    
+                    # Update session row and in-memory progress together
+                    record_harvest_progress(self.session_id, page, self.total_domains, self.server, self.record_type)
+        except Exception as e:
+            logger.error(f"Harvest writer error for session {self.session_id}: {e}")
+            self.error = e
+            # Keep consuming so the fetch loop never blocks on a full queue - unless the
+            # failure was the final COMMIT, after the sentinel was already taken
+            if not closed:
+                while self.queue.get() is not None:
+                    pass
+
+# Connections kept alive to ViewDNS across all harvests (one per in-flight page)
+VIEWDNS_POOL_SIZE = max(32, VIEWDNS_PREFETCH_PAGES)
+# Connect / read timeouts for ViewDNS requests
+VIEWDNS_TIMEOUT = (5, 30)
+
+def create_viewdns_session(pool_size=VIEWDNS_POOL_SIZE):
+    """Build the pooled keep-alive session used for every ViewDNS request.
+    
+    Pages reuse the same TCP/TLS connections, and once every pooled connection
+    is busy further requests wait for one instead of opening (and then
+    discarding) extra sockets.
+    """
+    session = requests.Session()
+    # 429/5xx answers are retried with exponential backoff, honouring Retry-After
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retries
+    )
+    session.mount('https://', adapter)
+    return session
+
+viewdns_session = create_viewdns_session()
 
 class ViewDNSAPI:
     """ViewDNS API client with unlimited auto-scroll harvesting."""
     
-    def __init__(self, api_key):
+    __slots__ = (
+        'api_key', 'base_url', 'reverse_mx_url', 'reverse_ns_url', 'base_params',
+        'prefetch_pages', 'rate_limiter', 'session'
+    )
+    
+    def __init__(self, api_key, rate_limit=VIEWDNS_RATE_LIMIT, prefetch_pages=VIEWDNS_PREFETCH_PAGES):
         self.api_key = api_key
         self.base_url = 'https://api.viewdns.info'
+        # Built once per client rather than on every page request
+        self.reverse_mx_url = f"{self.base_url}/reversemx/"
+        self.reverse_ns_url = f"{self.base_url}/reversens/"
+        self.base_params = {'apikey': api_key, 'output': 'json'}
+        self.prefetch_pages = max(1, prefetch_pages)
+        self.rate_limiter = RateLimiter(rate_limit)
+        
+        # Shared pooled session - warm connections carry over between harvests
+        self.session = viewdns_session
         
     def reverse_mx_lookup(self, mx_host, page=1):
         """Fetch reverse MX lookup data from ViewDNS API."""
-        url = f"{self.base_url}/reversemx/"
-        params = {
-            'mx': mx_host,
-            'apikey': self.api_key,
-            'output': 'json',
-            'page': page
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            
-            # Check if response is JSON
-            content_type = response.headers.get('content-type', '')
-            if 'application/json' not in content_type:
-                logger.error(f"API returned non-JSON response: {response.text[:200]}")
-                return None
-            
-            data = response.json()
-            
-            # Handle API error responses
-            if isinstance(data, str):
-                logger.error(f"API returned error string: {data}")
-                return None
-                
-            if 'response' not in data:
-                logger.error(f"Unexpected API response structure: {data}")
-                return None
-                
-            return data['response']
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"ViewDNS API request failed: {e}")
-            return None
-        except ValueError as e:
-            logger.error(f"Failed to parse JSON response: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"ViewDNS API error: {e}")
-            return None
+        return self.lookup(self.reverse_mx_url, {**self.base_params, 'mx': mx_host, 'page': page})
     
     def reverse_ns_lookup(self, ns_host, page=1):
         """Fetch reverse NS lookup data from ViewDNS API."""
-        url = f"{self.base_url}/reversens/"
-        params = {
-            'ns': ns_host,
-            'apikey': self.api_key,
-            'output': 'json',
-            'page': page
-        }
-        
+        return self.lookup(self.reverse_ns_url, {**self.base_params, 'ns': ns_host, 'page': page})
+    
+    def lookup(self, url, params):
+        """Fetch one ViewDNS page and return its 'response' object (None on any failure)."""
+        body = b''
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
+            # Streamed so the body is read in one piece instead of being joined from 10 KB chunks
+            with self.session.get(url, params=params, timeout=VIEWDNS_TIMEOUT, stream=True) as response:
+                if response.status_code == 429:
+                    # Still throttled after the adapter's retries - slow down every worker
+                    self.rate_limiter.pause(retry_after_seconds(response))
+                response.raise_for_status()
+                body = response.raw.read(decode_content=True)
             
-            # Check if response is JSON
-            content_type = response.headers.get('content-type', '')
-            if 'application/json' not in content_type:
-                logger.error(f"API returned non-JSON response: {response.text[:200]}")
+            # HTML error pages are turned away on their first byte, without a parse attempt
+            if not looks_like_json(body):
+                logger.error(f"ViewDNS returned a non-JSON response: {body[:200]!r}")
                 return None
-            
-            data = response.json()
+            data = orjson.loads(body)
             
             # Handle API error responses
             if isinstance(data, str):
@@ -196,18 +648,27 @@ class ViewDNSAPI:
         except requests.exceptions.RequestException as e:
             logger.error(f"ViewDNS API request failed: {e}")
             return None
-        except ValueError as e:
-            logger.error(f"Failed to parse JSON response: {e}")
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON response: {e} - {body[:200]!r}")
             return None
         except Exception as e:
             logger.error(f"ViewDNS API error: {e}")
             return None
     
+    def fetch_page(self, record_type, server, page):
+        """Fetch a single page of results, waiting for a rate limiter slot first."""
+        self.rate_limiter.wait()
+        
+        if record_type == 'mx':
+            return self.reverse_mx_lookup(server, page)
+        return self.reverse_ns_lookup(server, page)
+    
     def harvest_all_domains(self, record_type, server, session_id, max_pages=None):
-        """Harvest all domains using auto-scroll pagination."""
+        """Harvest all domains using auto-scroll pagination with concurrent page prefetch."""
         logger.info(f"Starting harvest for {record_type.upper()} server: {server}")
         
-        page = 1
+        next_page = 1
+        last_page = 0
         total_domains = 0
         consecutive_empty_pages = 0
         max_empty_pages = 3  # Stop after 3 consecutive empty pages
@@ -215,309 +676,416 @@ class ViewDNSAPI:
         # Update session status
         update_harvest_session(session_id, status='running', pages_fetched=0)
         
-        while True:
-            # Check max pages limit
-            if max_pages and page > max_pages:
-                logger.info(f"Reached max pages limit: {max_pages}")
-                break
-                
-            logger.info(f"Fetching page {page} for {server}...")
-            
-            # Fetch data based on record type
-            if record_type == 'mx':
-                data = self.reverse_mx_lookup(server, page)
-            else:
-                data = self.reverse_ns_lookup(server, page)
+        # Database writes run on their own thread so the fetch loop only waits on the network
+        writer = HarvestPageWriter(record_type, server, session_id)
+        writer.start()
+        
+        try:
+            # Bound once - the window refill below runs for every page
+            prefetch_pages = self.prefetch_pages
+            fetch_page = self.fetch_page
             
-            if not data or 'domains' not in data:
-                consecutive_empty_pages += 1
-                logger.warning(f"No data on page {page} (consecutive empty: {consecutive_empty_pages})")
+            with ThreadPoolExecutor(max_workers=prefetch_pages) as executor:
+                # Sliding window of in-flight pages, consumed strictly in page order
+                pending = deque()
                 
-                if consecutive_empty_pages >= max_empty_pages:
-                    logger.info(f"Stopping after {consecutive_empty_pages} consecutive empty pages")
-                    break
-                    
-                page += 1
-                continue
-            
-            domains = data['domains']
-            if not domains:
-                consecutive_empty_pages += 1
-                logger.warning(f"Empty domains list on page {page}")
+                def fill_window():
+                    nonlocal next_page
+                    while len(pending) < prefetch_pages and not (max_pages and next_page > max_pages):
+                        logger.info(f"Fetching page {next_page} for {server}...")
+                        pending.append((next_page, executor.submit(fetch_page, record_type, server, next_page)))
+                        next_page += 1
+                
+                fill_window()
                 
-                if consecutive_empty_pages >= max_empty_pages:
-                    logger.info(f"Stopping after {consecutive_empty_pages} consecutive empty pages")
-                    break
+                while pending:
+                    if writer.error is not None:
+                        # No point fetching pages that cannot be stored
+                        break
                     
-                page += 1
-                continue
-            
-            # Reset consecutive empty pages counter
-            consecutive_empty_pages = 0
-            
-            # Insert domains into database
-            page_count = insert_domains_batch(domains, record_type, server, session_id)
-            total_domains += page_count
-            
-            logger.info(f"Page {page}: {page_count} domains, Total: {total_domains}")
-            
-            # Update session progress
-            update_harvest_session(session_id, pages_fetched=page, total_domains=total_domains)
-            
-            # Update global progress
-            harvest_progress[session_id] = {
-                'page': page,
-                'total_domains': total_domains,
-                'server': server,
-                'record_type': record_type
-            }
-            
-            page += 1
-            
-            # Rate limiting - be respectful to the API
-            time.sleep(1)
+                    page, future = pending.popleft()
+                    data = future.result()
+                    last_page = page
+                    
+                    if not data or 'domains' not in data:
+                        consecutive_empty_pages += 1
+                        logger.warning(f"No data on page {page} (consecutive empty: {consecutive_empty_pages})")
+                        
+                        if consecutive_empty_pages >= max_empty_pages:
+                            logger.info(f"Stopping after {consecutive_empty_pages} consecutive empty pages")
+                            break
+                        
+                        fill_window()
+                        continue
+                    
+                    domains = data['domains']
+                    if not domains:
+                        consecutive_empty_pages += 1
+                        logger.warning(f"Empty domains list on page {page}")
+                        
+                        if consecutive_empty_pages >= max_empty_pages:
+                            logger.info(f"Stopping after {consecutive_empty_pages} consecutive empty pages")
+                            break
+                        
+                        fill_window()
+                        continue
+                    
+                    # Reset consecutive empty pages counter
+                    consecutive_empty_pages = 0
+                    
+                    # Keep the network busy, then hand the page over (blocks only if the writer is behind)
+                    fill_window()
+                    writer.put(page, domains)
+                else:
+                    if max_pages:
+                        logger.info(f"Reached max pages limit: {max_pages}")
+                
+                # Drop prefetched pages we no longer need
+                for _, future in pending:
+                    future.cancel()
+        finally:
+            writer.close()
+        
+        if writer.error is not None:
+            raise writer.error
+        total_domains = writer.total_domains
         
         # Mark session as complete
-        update_harvest_session(session_id, status='complete', total_domains=total_domains)
+        finish_harvest(session_id, 'complete', total_domains=total_domains)
+        invalidate_stats_cache()
+        
+        # One checkpoint per session - reordering/compaction is a separate maintenance action
+        checkpoint_database()
         
-        logger.info(f"Harvest complete for {server}: {total_domains} domains across {page-1} pages")
+        logger.info(f"Harvest complete for {server}: {total_domains} domains across {last_page} pages")
         return total_domains
 
-def format_domain_url(domain):
-    """
-    Format domain as clickable URL by adding http:// prefix if not present.
-    Ensures consistent URL formatting across the application.
-    
-    Args:
-        domain (str): Domain name to format
-        
-    Returns:
-        str: Formatted URL with http:// prefix
+# Strips a leading http:// or https:// from a `domain` column, leaving the bare hostname
+BARE_DOMAIN_SQL = "regexp_replace(domain, '^https?://', '')"
+
+# The cleaned, distinct domains of a registered `batch_table`
+BATCH_DOMAINS_SQL = f"""
+    SELECT DISTINCT domain
+    FROM (SELECT regexp_replace(lower(trim(domain)), '^https?://', '') AS domain FROM batch_table)
+    WHERE length(domain) > 0
+"""
+
+def add_unique_domains(batch_table):
+    """Add a batch's cleaned names to unique_domains in a short transaction of its own.
+    
+    The PRIMARY KEY insert commits on the autocommit cursor under db_write_lock.
+    Inside a harvest's batched transaction, two harvests sharing a domain would
+    both insert it and the second COMMIT would fail with a constraint violation.
+    Harvests call it from BatchedTransaction.after_commit, so names from
+    rolled-back pages are never added.
     """
-    if not domain:
-        return domain
-    
-    # Check if already has protocol
-    if domain.startswith(('http://', 'https://')):
-        return domain
-    
-    # Add http:// prefix to make clickable
-    return f"http://{domain}"
+    with db_write_lock:
+        cursor = get_autocommit_db()
+        cursor.register('batch_table', batch_table)
+        try:
+            cursor.execute(f"INSERT INTO unique_domains {BATCH_DOMAINS_SQL} ON CONFLICT DO NOTHING")
+        finally:
+            cursor.unregister('batch_table')
 
-def insert_domains_batch(domains, record_type, server, session_id):
-    """Insert a batch of domains into the database using DuckDB."""
-    conn = duckdb.connect(DATABASE)
+def insert_domains_batch(domains, record_type, server, session_id, conn=None, transaction=None):
+    """Insert a batch of domains into the database using DuckDB.
+    
+    Trimming, lower-casing, empty filtering and protocol stripping run as vectorized
+    SQL over the raw batch instead of per-row Python calls. Domains already stored for this
+    server (or repeated within the batch) are skipped by an anti-join, so the
+    returned count only covers genuinely new rows.
+    
+    A failed insert raises: during a harvest it has aborted the batched
+    transaction, so the page group is lost and the harvest must fail with it.
+    Inside a BatchedTransaction (`transaction`), unique_domains and the server
+    counter are only updated once the inserted rows have committed.
+    """
+    if conn is None:
+        conn = get_db()
     
     inserted_count = 0
     
     # Handle case where domains might be a string or unexpected format
     if not isinstance(domains, list):
         logger.error(f"Expected list of domains, got: {type(domains)} - {domains}")
-        conn.close()
         return 0
     
-    # Prepare batch data for insertion
-    batch_data = []
+    mx_value = server if record_type == 'mx' else None
+    ns_value = server if record_type == 'ns' else None
+    server_column = 'mx' if record_type == 'mx' else 'ns'
     
-    for domain in domains:
-        # ViewDNS returns domains as plain strings, not objects
-        if isinstance(domain, str):
-            domain_name = domain.strip()
-        elif isinstance(domain, dict):
-            # Fallback for other APIs that might return objects
-            domain_name = domain.get('domain', '').strip()
-        else:
-            logger.warning(f"Unexpected domain format: {domain}")
-            continue
-            
-        if not domain_name:
-            continue
-            
-        mx_value = server if record_type == 'mx' else None
-        ns_value = server if record_type == 'ns' else None
-        
-        # Format domain as clickable URL
-        formatted_domain = format_domain_url(domain_name)
-        
-        # Add to batch data
-        batch_data.append((
-            formatted_domain, 
-            mx_value, 
-            ns_value, 
-            'viewdns', 
-            session_id
-        ))
+    # ViewDNS returns domains as plain strings - hand the decoded list straight to Arrow,
+    # which converts it in C; only other shapes go through the Python loop
+    try:
+        domain_array = pa.array(domains, type=pa.string())
+        raw_domains = domains
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        raw_domains = []
+        for domain in domains:
+            if isinstance(domain, str):
+                raw_domains.append(domain)
+            elif isinstance(domain, dict):
+                # Fallback for other APIs that might return objects
+                raw_domains.append(domain.get('domain', ''))
+            else:
+                logger.warning(f"Unexpected domain format: {domain}")
+        domain_array = pa.array(raw_domains, type=pa.string())
     
     # Bulk insert using DuckDB - much faster than individual inserts
-    if batch_data:
-        try:
-            # Create DataFrame for faster bulk insert
-            df = pd.DataFrame(batch_data, columns=['domain', 'mx', 'ns', 'provider', 'session_id'])
-            
-            # Use DuckDB's INSERT from DataFrame (extremely fast)
-            conn.execute("""
-                INSERT OR IGNORE INTO domains (id, domain, mx, ns, provider, session_id)
-                SELECT nextval('domains_id_seq'), domain, mx, ns, provider, session_id
-                FROM df
-            """)
-            
-            inserted_count = len(batch_data)
-            logger.info(f"Bulk inserted {inserted_count} domains")
-            
-        except Exception as e:
-            logger.error(f"Bulk insert error: {e}")
-            # Fallback to individual inserts
-            for data in batch_data:
+    if raw_domains:
+        with db_write_lock:
+            try:
+                # Wrap the names in an Arrow table (zero-copy scan for DuckDB)
+                batch_table = pa.table({'domain': domain_array})
+                
+                # Use DuckDB's INSERT from the registered Arrow table (extremely fast)
+                conn.register('batch_table', batch_table)
                 try:
-                    conn.execute("""
-                        INSERT OR IGNORE INTO domains (id, domain, mx, ns, provider, session_id)
-                        VALUES (nextval('domains_id_seq'), ?, ?, ?, ?, ?)
-                    """, data)
-                    inserted_count += 1
-                except Exception as inner_e:
-                    logger.error(f"Individual insert error: {inner_e}")
-    
-    conn.close()
+                    inserted_count = conn.execute(f"""
+                        INSERT INTO domains (domain, mx, ns, provider, session_id)
+                        SELECT new_domains.domain, ?, ?, 'viewdns', ?
+                        FROM ({BATCH_DOMAINS_SQL}) AS new_domains
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM domains existing
+                            WHERE existing.domain = new_domains.domain
+                              AND existing.{server_column} = ?
+                        )
+                    """, (mx_value, ns_value, session_id, server)).fetchone()[0]
+                finally:
+                    conn.unregister('batch_table')
+                
+                logger.info(f"Bulk inserted {inserted_count} new domains")
+                
+            except Exception as e:
+                logger.error(f"Bulk insert error: {e}")
+                raise
+    
+    if inserted_count:
+        # Names skipped by the anti-join were recorded when their rows were inserted
+        def record_inserted():
+            add_unique_domains(batch_table)
+            count_server_domains(record_type, server, inserted_count)
+        
+        if transaction is None:
+            record_inserted()
+        else:
+            transaction.after_commit(record_inserted)
+    
     return inserted_count
 
-def create_harvest_session(server, record_type, provider='viewdns'):
+def count_server_domains(record_type, server, count, provider='viewdns'):
+    """Add committed rows to the server's counter in a short transaction of its own.
+    
+    Runs on the autocommit cursor under db_write_lock, so concurrent harvests of
+    one server apply their deltas one after another instead of both holding the
+    counter row in their batched transactions. Harvests call it from
+    BatchedTransaction.after_commit, so rolled-back rows are never counted.
+    """
+    with db_write_lock:
+        get_autocommit_db().execute("""
+            INSERT INTO server_counts VALUES (?, ?, ?, ?)
+            ON CONFLICT (kind, server, provider) DO UPDATE SET n = n + excluded.n
+        """, (record_type, server, provider, count))
+
+def create_harvest_session(server, record_type, provider='viewdns', conn=None):
     """Create a new harvest session."""
     session_id = f"{provider}_{record_type}_{server}_{int(time.time())}"
     
-    conn = duckdb.connect(DATABASE)
-    
-    conn.execute('''
-        INSERT INTO harvest_sessions (id, server, record_type, provider)
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, server, record_type, provider))
+    if conn is None:
+        conn = get_db()
     
-    conn.close()
+    with db_write_lock:
+        conn.execute('''
+            INSERT INTO harvest_sessions (id, server, record_type, provider)
+            VALUES (?, ?, ?, ?)
+        ''', (session_id, server, record_type, provider))
     
     return session_id
 
-def update_harvest_session(session_id, **kwargs):
-    """Update harvest session with new information."""
-    conn = duckdb.connect(DATABASE)
+def write_harvest_session(conn, session_id, updates):
+    """Apply one set of column updates to a harvest session row.
     
-    updates = []
-    values = []
+    Progress counters and status go out as separate statements, so a failed
+    status change never takes the progress it was merged with down too.
+    """
+    # Fixed column order so each combination yields the same SQL text
+    columns = [key for key in ['total_domains', 'pages_fetched'] if key in updates]
+    
+    with db_write_lock:
+        if columns:
+            assignments = ', '.join(f"{key} = ?" for key in columns)
+            conn.execute(
+                f"UPDATE harvest_sessions SET {assignments} WHERE id = ?",
+                [updates[key] for key in columns] + [session_id]
+            )
+        
+        if 'status' in updates:
+            completed = ", completed_at = CURRENT_TIMESTAMP" if updates['status'] == 'complete' else ""
+            conn.execute(
+                f"UPDATE harvest_sessions SET status = ?{completed} WHERE id = ?",
+                (updates['status'], session_id)
+            )
+
+class SessionUpdateWriter:
+    """Background writer that applies queued harvest_sessions updates.
     
-    for key, value in kwargs.items():
-        if key in ['status', 'total_domains', 'pages_fetched']:
-            updates.append(f"{key} = ?")
-            values.append(value)
+    Harvest threads enqueue without waiting on the database; the writer drains
+    the queue in small batches and coalesces them into one UPDATE per session.
+    """
     
-    if updates:
-        if kwargs.get('status') == 'complete':
-            updates.append("completed_at = CURRENT_TIMESTAMP")
-            
-        query = f"UPDATE harvest_sessions SET {', '.join(updates)} WHERE id = ?"
-        values.append(session_id)
+    def __init__(self, max_wait=0.1, max_batch=64):
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+    
+    def submit(self, session_id, updates):
+        """Queue an update for a session (never blocks on the database)."""
+        self._ensure_started()
+        self.queue.put_nowait((session_id, updates))
+    
+    def flush(self):
+        """Block until every queued update has been written."""
+        self.queue.join()
+    
+    def _ensure_started(self):
+        if self.thread is None:
+            with self.start_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+                    self.thread.start()
+    
+    def _drain(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
         
-        conn.execute(query, values)
+        return batch
     
-    conn.close()
+    def _run(self):
+        conn = get_db()
+        
+        while True:
+            batch = self._drain()
+            
+            # Later updates for the same session win
+            merged = {}
+            for session_id, updates in batch:
+                merged.setdefault(session_id, {}).update(updates)
+            
+            try:
+                # One failing session must not drop the updates queued for the others
+                for session_id, updates in merged.items():
+                    try:
+                        write_harvest_session(conn, session_id, updates)
+                    except Exception as e:
+                        logger.error(f"Session update error for {session_id}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+session_writer = SessionUpdateWriter()
 
-def get_database_stats():
-    """Get comprehensive database statistics with DuckDB optimizations."""
-    conn = duckdb.connect(DATABASE)
+def update_harvest_session(session_id, **kwargs):
+    """Update harvest session with new information (queued for the background writer)."""
+    session_writer.submit(session_id, kwargs)
+
+def query_database_stats(conn=None):
+    """Get comprehensive database statistics from the maintained counter tables.
     
-    try:
-        # Use single query with multiple aggregations for better performance
-        stats_query = """
-        WITH domain_stats AS (
-            SELECT 
-                COUNT(*) as total_records,
-                COUNT(DISTINCT domain) as unique_domains,
-                COUNT(CASE WHEN mx IS NOT NULL THEN 1 END) as mx_count,
-                COUNT(CASE WHEN ns IS NOT NULL THEN 1 END) as ns_count
-            FROM domains
-        ),
-        provider_stats AS (
-            SELECT provider, COUNT(*) as count 
-            FROM domains 
-            GROUP BY provider
-        ),
-        top_mx AS (
-            SELECT mx, COUNT(*) as count 
-            FROM domains 
-            WHERE mx IS NOT NULL 
-            GROUP BY mx 
-            ORDER BY count DESC 
-            LIMIT 10
-        ),
-        top_ns AS (
-            SELECT ns, COUNT(*) as count 
-            FROM domains 
-            WHERE ns IS NOT NULL 
-            GROUP BY ns 
-            ORDER BY count DESC 
-            LIMIT 10
-        ),
-        recent_harvests AS (
-            SELECT server, record_type, provider, total_domains, status, started_at
-            FROM harvest_sessions 
-            ORDER BY started_at DESC 
-            LIMIT 10
-        )
-        SELECT * FROM domain_stats
-        """
-        
-        # Get main stats
-        result = conn.execute(stats_query).fetchone()
-        total_records, unique_domains, mx_count, ns_count = result
-        
-        # Get provider breakdown
-        by_provider = dict(conn.execute("SELECT provider, COUNT(*) FROM domains GROUP BY provider").fetchall())
-        
-        # Get top servers
-        top_mx_servers = conn.execute("""
-            SELECT mx, COUNT(*) as count FROM domains 
-            WHERE mx IS NOT NULL 
-            GROUP BY mx 
-            ORDER BY count DESC 
-            LIMIT 10
-        """).fetchall()
-        
-        top_ns_servers = conn.execute("""
-            SELECT ns, COUNT(*) as count FROM domains 
-            WHERE ns IS NOT NULL 
-            GROUP BY ns 
-            ORDER BY count DESC 
-            LIMIT 10
-        """).fetchall()
-        
-        # Get recent harvests
-        recent_harvests = conn.execute("""
-            SELECT server, record_type, provider, total_domains, status, started_at
-            FROM harvest_sessions 
-            ORDER BY started_at DESC 
-            LIMIT 10
-        """).fetchall()
-        
-        return {
-            'total_records': total_records,
-            'unique_domains': unique_domains,
-            'by_type': {'mx': mx_count, 'ns': ns_count},
-            'by_provider': by_provider,
-            'top_mx_servers': top_mx_servers,
-            'top_ns_servers': top_ns_servers,
-            'recent_harvests': recent_harvests
-        }
+    Nothing here scans domains: the unique-domain count is the size of
+    unique_domains and everything else is summed from server_counts.
+    """
+    if conn is None:
+        conn = get_db()
+    
+    unique_domains = conn.execute("SELECT COUNT(*) FROM unique_domains").fetchone()[0]
+    
+    # Totals, provider breakdown and top servers come from the maintained counters
+    server_counts = conn.execute("SELECT kind, server, provider, n FROM server_counts").fetchall()
+    
+    by_type = {'mx': 0, 'ns': 0}
+    by_provider = defaultdict(int)
+    servers = {'mx': defaultdict(int), 'ns': defaultdict(int)}
+    for kind, server, provider, count in server_counts:
+        by_type[kind] += count
+        by_provider[provider] += count
+        servers[kind][server] += count
+    total_records = by_type['mx'] + by_type['ns']
+    
+    # Get top servers
+    top_mx_servers = sorted(servers['mx'].items(), key=lambda item: item[1], reverse=True)[:10]
+    top_ns_servers = sorted(servers['ns'].items(), key=lambda item: item[1], reverse=True)[:10]
+    
+    # Get recent harvests
+    recent_harvests = conn.execute("""
+        SELECT server, record_type, provider, total_domains, status, started_at
+        FROM harvest_sessions 
+        ORDER BY started_at DESC 
+        LIMIT 10
+    """).fetchall()
+    
+    return {
+        'total_records': total_records,
+        'unique_domains': unique_domains,
+        'by_type': by_type,
+        'by_provider': dict(by_provider),
+        'top_mx_servers': top_mx_servers,
+        'top_ns_servers': top_ns_servers,
+        'recent_harvests': recent_harvests
+    }
+
+# Short-lived stats cache - dashboard views and polling don't need per-request freshness
+STATS_CACHE_TTL = 5  # seconds
+_stats_cache = None  # (expires_at, version, stats)
+_stats_version = 0
+_stats_lock = threading.Lock()
+
+def invalidate_stats_cache():
+    """Drop cached stats so the next request rescans (call after data changes)."""
+    global _stats_version, _stats_cache
+    with _stats_lock:
+        _stats_version += 1
+        _stats_cache = None
+
+def get_database_stats(conn=None):
+    """Get database statistics, served from a short TTL cache when fresh."""
+    global _stats_cache
+    cached = _stats_cache
+    if cached and cached[0] > time.monotonic() and cached[1] == _stats_version:
+        return cached[2]
+    
+    # Serialize recomputation so a burst of requests triggers a single scan
+    with _stats_lock:
+        cached = _stats_cache
+        if cached and cached[0] > time.monotonic() and cached[1] == _stats_version:
+            return cached[2]
         
-    except Exception as e:
-        logger.error(f"Error getting database stats: {e}")
-        return {
-            'total_records': 0,
-            'unique_domains': 0,
-            'by_type': {'mx': 0, 'ns': 0},
-            'by_provider': {},
-            'top_mx_servers': [],
-            'top_ns_servers': [],
-            'recent_harvests': []
-        }
-    finally:
-        conn.close()
+        try:
+            stats = query_database_stats(conn)
+        except Exception as e:
+            logger.error(f"Error getting database stats: {e}")
+            return {
+                'total_records': 0,
+                'unique_domains': 0,
+                'by_type': {'mx': 0, 'ns': 0},
+                'by_provider': {},
+                'top_mx_servers': [],
+                'top_ns_servers': [],
+                'recent_harvests': []
+            }
+        
+        _stats_cache = (time.monotonic() + STATS_CACHE_TTL, _stats_version, stats)
+        return stats
 
 @app.route('/')
 def home():
@@ -542,19 +1110,14 @@ def harvest():
         flash('Invalid record type. Please select MX or NS.', 'error')
         return redirect(url_for('home'))
     
-    # Convert max_pages to int if provided
+    # Convert max_pages to int if provided (0 means unlimited)
     max_pages_int = None
     if max_pages:
-        try:
-            max_pages_int = int(max_pages)
-            if max_pages_int <= 0:
-                max_pages_int = None
-        except ValueError:
+        if max_pages.isdigit():
+            max_pages_int = int(max_pages) or None
+        else:
             flash('Invalid max pages value. Using unlimited.', 'warning')
     
-    # Create harvest session
-    session_id = create_harvest_session(server, record_type, api_provider)
-    
     if api_provider == 'viewdns':
         if not VIEWDNS_API_KEY:
             flash('ViewDNS API key not configured. Please check your .env file.', 'error')
@@ -568,12 +1131,16 @@ def harvest():
                 logger.info(f'Harvest completed! Fetched {total:,} domains for {server}')
             except Exception as e:
                 logger.error(f"Harvest error: {e}")
-                update_harvest_session(session_id, status='error')
+                finish_harvest(session_id, 'error')
         
         thread = threading.Thread(target=harvest_worker)
         thread.daemon = True
-        thread.start()
-        harvest_threads[session_id] = thread
+        # Create the session only once the request is known to start one, and register its
+        # thread in the same step so maintain_domains_storage never misses a starting harvest
+        with harvest_lock:
+            session_id = create_harvest_session(server, record_type, api_provider)
+            harvest_threads[session_id] = thread
+            thread.start()
         
         flash(f'Started harvesting {record_type.upper()} domains for {server} using ViewDNS API!', 'info')
         
@@ -582,12 +1149,16 @@ def harvest():
     
     return redirect(url_for('home'))
 
+# Filename sanitizing tables, built once at import
+INVALID_FILENAME_CHARS = str.maketrans({char: '_' for char in '<>:"/\\|?*'})
+MULTIPLE_UNDERSCORES = re.compile(r'_{2,}')
+
 def sanitize_filename(filename):
     """Sanitize filename to remove invalid characters."""
     # Remove or replace invalid characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = filename.translate(INVALID_FILENAME_CHARS)
     # Remove multiple consecutive underscores
-    filename = re.sub(r'_+', '_', filename)
+    filename = MULTIPLE_UNDERSCORES.sub('_', filename)
     # Remove leading/trailing underscores and dots
     filename = filename.strip('_.')
     # Limit length
@@ -607,108 +1178,133 @@ def generate_filename(server, record_type, file_format, timestamp=None):
     filename = f"{safe_server}_{safe_record_type}_{timestamp}.{file_format}"
     return filename
 
-def create_excel_export(results, server=None, record_type=None):
-    """Create an Excel file with the results - handles large datasets by chunking."""
-    total_results = len(results)
+# Column headers shared by all export formats
+EXPORT_HEADERS = ['Domain', 'MX Record', 'NS Record', 'Provider', 'Fetched At']
+
+# Select list for spreadsheet rows - the link prefix, blanks and the provider fallback are
+# filled in by DuckDB, so each fetched row tuple can be appended to a sheet unchanged
+EXPORT_ROW_SQL = "'http://' || domain, coalesce(mx, ''), coalesce(ns, ''), coalesce(provider, 'Unknown'), fetched_at"
+
+# Sheet columns holding a handful of repeated servers/providers (mx, ns, provider)
+DICTIONARY_COLUMNS = (1, 2, 3)
+
+def dictionary_values(column):
+    """Convert a low-cardinality column to Python values via its Arrow dictionary encoding.
+    
+    Each distinct value becomes one Python string and rows share it by index, instead
+    of allocating a new string object per cell.
+    """
+    encoded = column.dictionary_encode()
+    values = encoded.dictionary.to_pylist()
+    return [values[index] for index in encoded.indices.to_pylist()]
+
+def batch_rows(batches):
+    """Iterate Arrow record batches as row tuples, converting one column of one batch at a time."""
+    for batch in batches:
+        columns = [
+            dictionary_values(column) if i in DICTIONARY_COLUMNS else column.to_pylist()
+            for i, column in enumerate(batch.columns)
+        ]
+        yield from zip(*columns)
+
+def sample_column_widths(rows, headers=EXPORT_HEADERS, sample_rows=200, max_width=50):
+    """Size columns from the first `sample_rows` rows (headers included).
+    
+    Returns the widths and an iterator that still yields every row, sampled ones first,
+    so the stream is read once.
+    """
+    sample = list(islice(rows, sample_rows))
+    widths = [len(header) for header in headers]
+    for record in sample:
+        for col, value in enumerate(record):
+            if value is not None:
+                widths[col] = max(widths[col], len(str(value)))
+    return [min(width + 2, max_width) for width in widths], chain(sample, rows)
+
+def set_column_widths(ws, widths):
+    """Apply column widths - must run before any rows are written in constant-memory mode."""
+    for col, width in enumerate(widths):
+        ws.set_column(col, col, width)
+
+def excel_workbook(path):
+    """Open a constant-memory workbook that flushes each row to disk as soon as the next starts."""
+    return xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'use_zip64': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        # Domains are exported as http:// links - keep them plain strings, not hyperlinks
+        'strings_to_urls': False,
+    })
+
+def excel_header_format(wb):
+    """Header style shared by the data and summary sheets."""
+    return wb.add_format({
+        'bold': True,
+        'font_color': '#FFFFFF',
+        'bg_color': '#366092',
+        'align': 'center',
+        'valign': 'vcenter',
+    })
+
+def create_excel_export(reader, total_results, server=None, record_type=None):
+    """Create an Excel file from a stream of Arrow record batches - handles large datasets by chunking.
+    
+    Returns the path of a temporary file that the caller must remove.
+    """
     max_excel_rows = 1048575  # Excel limit minus header row
     
-    # If dataset is small enough for single Excel file
-    if total_results <= max_excel_rows:
-        wb = Workbook()
-        ws = wb.active
-        
-        # Set sheet name
-        sheet_name = f"{record_type.upper() if record_type else 'ALL'}_Records"
-        ws.title = sheet_name
-        
-        # Define headers
-        headers = ['Domain', 'MX Record', 'NS Record', 'Provider', 'Fetched At']
-        
-        # Style headers
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Add headers
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-        
-        # Add data
-        for row, record in enumerate(results, 2):
-            ws.cell(row=row, column=1, value=record[0])  # Domain
-            ws.cell(row=row, column=2, value=record[1] or '')  # MX
-            ws.cell(row=row, column=3, value=record[2] or '')  # NS
-            ws.cell(row=row, column=4, value=record[3] or 'Unknown')  # Provider
-            ws.cell(row=row, column=5, value=record[4])  # Fetched At
-        
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # Max width of 50
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Add summary sheet if large dataset
-        if len(results) > 1000:
-            summary_ws = wb.create_sheet("Summary")
-            summary_data = [
-                ["Export Summary", ""],
-                ["Total Records", len(results)],
-                ["Server", server or "All Servers"],
-                ["Record Type", record_type.upper() if record_type else "All Types"],
-                ["Export Date", datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-                ["", ""],
-                ["Top Domains", "Count"]
-            ]
-            
-            for row, data in enumerate(summary_data, 1):
-                summary_ws.cell(row=row, column=1, value=data[0])
-                summary_ws.cell(row=row, column=2, value=data[1])
-        
-        # Save to BytesIO
-        excel_file = io.BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
+    # For large datasets, spread the rows over multiple worksheets
+    if total_results > max_excel_rows:
+        return create_chunked_excel_export(reader, total_results, server, record_type)
+    
+    excel_path = temp_export_path('.xlsx')
+    wb = excel_workbook(excel_path)
+    header_format = excel_header_format(wb)
+    
+    # Set sheet name
+    ws = wb.add_worksheet(f"{record_type.upper() if record_type else 'ALL'}_Records")
+    widths, rows = sample_column_widths(batch_rows(reader))
+    set_column_widths(ws, widths)
+    
+    # Add headers, then stream the data rows underneath
+    ws.write_row(0, 0, EXPORT_HEADERS, header_format)
+    for row, record in enumerate(rows, 1):
+        ws.write_row(row, 0, record)
+    
+    # Add summary sheet if large dataset
+    if total_results > 1000:
+        summary_ws = wb.add_worksheet("Summary")
+        summary_data = [
+            ["Export Summary", ""],
+            ["Total Records", total_results],
+            ["Server", server or "All Servers"],
+            ["Record Type", record_type.upper() if record_type else "All Types"],
+            ["Export Date", datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+            ["", ""],
+            ["Top Domains", "Count"]
+        ]
         
-        return excel_file
+        for row, data in enumerate(summary_data):
+            summary_ws.write_row(row, 0, data)
     
-    # For large datasets, create multiple Excel files in a ZIP
-    else:
-        return create_chunked_excel_export(results, server, record_type)
+    wb.close()
+    return excel_path
 
-def create_chunked_excel_export(results, server=None, record_type=None):
+def create_chunked_excel_export(reader, total_results, server=None, record_type=None):
     """Create a single Excel file with multiple worksheets for large datasets."""
     max_excel_rows = 1048575  # Excel limit minus header row
-    headers = ['Domain', 'MX Record', 'NS Record', 'Provider', 'Fetched At']
     
-    # Create workbook
-    wb = Workbook()
-    
-    # Remove default sheet
-    default_sheet = wb.active
-    wb.remove(default_sheet)
-    
-    # Style definitions
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
+    excel_path = temp_export_path('.xlsx')
+    wb = excel_workbook(excel_path)
+    header_format = excel_header_format(wb)
     
     # Create summary sheet first
-    summary_ws = wb.create_sheet("Summary", 0)
-    total_sheets = (len(results) // max_excel_rows) + 1
+    summary_ws = wb.add_worksheet("Summary")
+    total_sheets = (total_results // max_excel_rows) + 1
     
     summary_data = [
         ["Export Summary", ""],
-        ["Total Records", len(results)],
+        ["Total Records", total_results],
         ["Total Worksheets", total_sheets],
         ["Server", server or "All Servers"],
         ["Record Type", record_type.upper() if record_type else "All Types"],
@@ -718,123 +1314,199 @@ def create_chunked_excel_export(results, server=None, record_type=None):
     ]
     
     # Add worksheet breakdown
-    for i in range(0, len(results), max_excel_rows):
+    for i in range(0, total_results, max_excel_rows):
         sheet_num = (i // max_excel_rows) + 1
-        chunk_size = min(max_excel_rows, len(results) - i)
+        chunk_size = min(max_excel_rows, total_results - i)
         start_record = i + 1
         end_record = i + chunk_size
         summary_data.append([f"Data_Sheet_{sheet_num}", chunk_size, f"{start_record}-{end_record}"])
     
+    # Auto-adjust summary column widths
+    summary_widths = [0, 0, 0]
+    for data in summary_data:
+        for col, value in enumerate(data):
+            summary_widths[col] = max(summary_widths[col], len(str(value)))
+    set_column_widths(summary_ws, [min(width + 2, 30) for width in summary_widths])
+    
     # Populate summary sheet
-    for row, data in enumerate(summary_data, 1):
-        for col, value in enumerate(data, 1):
-            cell = summary_ws.cell(row=row, column=col, value=value)
-            if row == 1:  # Header row
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-            elif row == 8:  # Column headers
-                cell.font = Font(bold=True)
+    column_header_format = wb.add_format({'bold': True})
+    for row, data in enumerate(summary_data):
+        if row == 0:  # Header row
+            summary_ws.write_row(row, 0, data, header_format)
+        elif row == 7:  # Column headers
+            summary_ws.write_row(row, 0, data, column_header_format)
+        else:
+            summary_ws.write_row(row, 0, data)
     
-    # Auto-adjust summary column widths
-    for column in summary_ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 30)
-        summary_ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Create data sheets
-    for i in range(0, len(results), max_excel_rows):
-        chunk = results[i:i + max_excel_rows]
+    # Create data sheets, each taking the next rows off the batch stream
+    widths, rows = sample_column_widths(batch_rows(reader))
+    for i in range(0, total_results, max_excel_rows):
         sheet_num = (i // max_excel_rows) + 1
         
         # Create worksheet
-        sheet_name = f"Data_Sheet_{sheet_num}"
-        ws = wb.create_sheet(sheet_name)
-        
-        # Add headers
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-        
-        # Add data
-        for row, record in enumerate(chunk, 2):
-            ws.cell(row=row, column=1, value=record[0])  # Domain
-            ws.cell(row=row, column=2, value=record[1] or '')  # MX
-            ws.cell(row=row, column=3, value=record[2] or '')  # NS
-            ws.cell(row=row, column=4, value=record[3] or 'Unknown')  # Provider
-            ws.cell(row=row, column=5, value=record[4])  # Fetched At
-        
-        # Auto-adjust column widths (sample first 100 rows for performance)
-        sample_rows = min(100, len(chunk))
-        for col_idx, column in enumerate(ws.columns, 1):
-            max_length = len(headers[col_idx - 1])  # Start with header length
-            for row_idx in range(2, sample_rows + 2):  # Sample rows
-                cell = ws.cell(row=row_idx, column=col_idx)
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # Max width of 50
-            ws.column_dimensions[column[0].column_letter].width = adjusted_width
+        ws = wb.add_worksheet(f"Data_Sheet_{sheet_num}")
+        set_column_widths(ws, widths)
+        
+        # Add headers, then this sheet's share of the data
+        ws.write_row(0, 0, EXPORT_HEADERS, header_format)
+        for row, record in enumerate(islice(rows, max_excel_rows), 1):
+            ws.write_row(row, 0, record)
     
-    # Save to BytesIO
-    excel_file = io.BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
+    wb.close()
+    return excel_path
+
+def build_export_filter(record_type=None, server=None):
+    """Build the WHERE clause and bound parameters for an export query."""
+    conditions = ["1=1"]
+    params = []
     
-    return excel_file
+    if record_type == 'mx':
+        conditions.append("mx IS NOT NULL")
+        if server:
+            conditions.append("mx = ?")
+            params.append(server)
+    elif record_type == 'ns':
+        conditions.append("ns IS NOT NULL")
+        if server:
+            conditions.append("ns = ?")
+            params.append(server)
+    
+    return " AND ".join(conditions), params
+
+# Rows per Arrow record batch when streaming query results into export files
+EXPORT_BATCH_ROWS = 131072
+
+# Spreadsheet rows become Python objects one batch at a time, so that window stays smaller
+SHEET_BATCH_ROWS = 16384
+
+def export_schema(schema):
+    """Rename a query's Arrow schema to the export column headers."""
+    return pa.schema([field.with_name(header) for field, header in zip(schema, EXPORT_HEADERS)])
+
+# Shard files written concurrently by chunked CSV exports, each on its own cursor
+EXPORT_SHARD_WORKERS = 4
+
+# Name prefix of the staging tables below - init_db drops any an interrupted export left behind
+EXPORT_ROWS_PREFIX = 'export_rows_'
+
+def stage_export_rows(conn, filter_sql, params, table_name):
+    """Number the matching rows once into a staging table that the CSV writers copy from.
+    
+    A regular (not TEMP) table is used so shard writers on other cursors can read it.
+    """
+    with db_write_lock:
+        conn.execute(f"""
+            CREATE TABLE {table_name} AS
+            SELECT row_number() OVER (ORDER BY fetched_at DESC) AS row_num,
+                   'http://' || domain AS domain, mx, ns, provider, fetched_at
+            FROM domains
+            WHERE {filter_sql}
+        """, params)
+
+def drop_export_rows(conn, table_name):
+    """Remove a staging table created by stage_export_rows."""
+    with db_write_lock:
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+def copy_export_rows(conn, table_name, path, row_filter='TRUE', compression='none'):
+    """Write staged export rows to a (optionally compressed) CSV file with DuckDB's native COPY writer."""
+    conn.execute(f"""
+        COPY (
+            SELECT domain AS "Domain", mx AS "MX Record", ns AS "NS Record",
+                   provider AS "Provider", fetched_at AS "Fetched At"
+            FROM {table_name}
+            WHERE {row_filter}
+            ORDER BY row_num
+        ) TO '{path}' (FORMAT CSV, HEADER, COMPRESSION '{compression}')
+    """)
 
-def create_chunked_csv_export(results, server=None, record_type=None, chunk_size=50000):
-    """Create multiple CSV files if dataset is too large."""
-    if len(results) <= chunk_size:
-        return create_single_csv_export(results)
+def write_export_shard(table_name, path, first_row, last_row):
+    """Copy one range of staged rows to its own CSV file using the worker thread's cursor."""
+    copy_export_rows(get_db(), table_name, path, f"row_num > {first_row} AND row_num <= {last_row}", 'zstd')
+
+def temp_export_path(suffix):
+    """Reserve a temporary file path for an export written by DuckDB."""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+def create_chunked_csv_export(conn, filter_sql, params, total_results, server=None, record_type=None, chunk_size=50000):
+    """Create multiple CSV files if dataset is too large.
     
-    # Create ZIP file with multiple CSV chunks
-    zip_buffer = io.BytesIO()
+    Rows are numbered once inside DuckDB and every chunk is written by DuckDB's
+    native CSV writer (COPY ... TO), several chunks at a time, so no row goes
+    through Python. Chunks are zstd-compressed by DuckDB as they are written and
+    stored uncompressed in a ZIP that is streamed out rather than assembled in memory.
+    """
+    table_name = f"{EXPORT_ROWS_PREFIX}{uuid.uuid4().hex}"
+    stage_export_rows(conn, filter_sql, params, table_name)
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        headers = ['Domain', 'MX Record', 'NS Record', 'Provider', 'Fetched At']
+    try:
+        if total_results <= chunk_size:
+            csv_path = temp_export_path('.csv')
+            copy_export_rows(conn, table_name, csv_path)
+            return csv_path
         
-        for i in range(0, len(results), chunk_size):
-            chunk = results[i:i + chunk_size]
-            chunk_num = (i // chunk_size) + 1
-            
-            # Create CSV for this chunk
-            csv_buffer = io.StringIO()
-            writer = csv.writer(csv_buffer)
-            writer.writerow(headers)
-            writer.writerows(chunk)
-            
-            # Add to ZIP
-            chunk_filename = f"chunk_{chunk_num:03d}.csv"
-            zip_file.writestr(chunk_filename, csv_buffer.getvalue())
+        # Chunk files stay on disk until the ZIP stream has been sent
+        temp_dir = tempfile.mkdtemp(prefix='export_')
+        zip_stream = ZipStream(compress_type=zipfile.ZIP_STORED)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=EXPORT_SHARD_WORKERS) as executor:
+                shards = []
+                for i in range(0, total_results, chunk_size):
+                    chunk_num = (i // chunk_size) + 1
+                    chunk_filename = f"chunk_{chunk_num:03d}.csv.zst"
+                    chunk_path = os.path.join(temp_dir, chunk_filename)
+                    
+                    # DuckDB releases the GIL while it writes, so shards encode in parallel
+                    future = executor.submit(write_export_shard, table_name, chunk_path, i, i + chunk_size)
+                    shards.append((future, chunk_path, chunk_filename))
+                
+                # Files are only read while the response streams - they are already compressed
+                for future, chunk_path, chunk_filename in shards:
+                    future.result()
+                    zip_stream.add_path(chunk_path, chunk_filename)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        
+        return stream_zip_directory(zip_stream, temp_dir)
+    finally:
+        drop_export_rows(conn, table_name)
+
+def stream_zip_directory(zip_stream, directory):
+    """Yield the ZIP stream's bytes, removing its source directory once the response closes."""
+    try:
+        yield from zip_stream
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def create_parquet_export(reader):
+    """Create a ZSTD-compressed Parquet file, writing one record batch (row group) at a time.
     
-    zip_buffer.seek(0)
-    return zip_buffer
+    Returns the path of a temporary file that the caller must remove.
+    """
+    schema = export_schema(reader.schema)
+    
+    parquet_path = temp_export_path('.parquet')
+    with pq.ParquetWriter(parquet_path, schema, compression='zstd', compression_level=10) as writer:
+        for batch in reader:
+            writer.write_batch(pa.RecordBatch.from_arrays(batch.columns, schema=schema))
+    return parquet_path
 
-def create_single_csv_export(results):
-    """Create a single CSV file."""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Domain', 'MX Record', 'NS Record', 'Provider', 'Fetched At'])
-    writer.writerows(results)
+def create_single_csv_export(reader):
+    """Create a single CSV file with Arrow's C++ CSV writer, one record batch at a time.
     
-    csv_data = output.getvalue()
-    output.close()
+    Returns the path of a temporary file that the caller must remove.
+    """
+    schema = export_schema(reader.schema)
     
-    csv_file = io.BytesIO(csv_data.encode('utf-8'))
-    csv_file.seek(0)
-    return csv_file
+    csv_path = temp_export_path('.csv')
+    with pcsv.CSVWriter(csv_path, schema, write_options=pcsv.WriteOptions(include_header=True)) as writer:
+        for batch in reader:
+            writer.write_batch(pa.RecordBatch.from_arrays(batch.columns, schema=schema))
+    return csv_path
 
 @app.route('/export')
 def export():
@@ -843,55 +1515,69 @@ def export():
     server = request.args.get('server')
     format_type = request.args.get('format', 'excel')  # Default to Excel
     
-    conn = duckdb.connect(DATABASE)
+    conn = get_db()
     
     # Build query based on filters
-    query = "SELECT domain, mx, ns, provider, fetched_at FROM domains WHERE 1=1"
-    params = []
+    filter_sql, params = build_export_filter(record_type, server)
+    query = f"SELECT 'http://' || domain AS domain, mx, ns, provider, fetched_at FROM domains WHERE {filter_sql} ORDER BY fetched_at DESC"
     
-    if record_type == 'mx':
-        query += " AND mx IS NOT NULL"
-        if server:
-            query += " AND mx = ?"
-            params.append(server)
-    elif record_type == 'ns':
-        query += " AND ns IS NOT NULL"
-        if server:
-            query += " AND ns = ?"
-            params.append(server)
-    
-    query += " ORDER BY fetched_at DESC"
+    # Generate timestamp
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
-    # Use pandas for faster data processing
-    df = conn.execute(query, params).df()
-    results = df.to_records(index=False).tolist()
-    conn.close()
+    # Count in SQL so choosing a format never needs the rows in Python
+    total_results = conn.execute(f"SELECT COUNT(*) FROM domains WHERE {filter_sql}", params).fetchone()[0]
     
-    if not results:
+    if total_results == 0:
         flash('No data to export!', 'warning')
         return redirect(url_for('home'))
     
-    # Generate timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
     # Handle different export formats
-    if format_type == 'excel':
-        file_buffer = create_excel_export(results, server, record_type)
+    if format_type == 'parquet':
+        # Parquet is columnar end to end - no Python row objects are ever created
+        reader = conn.execute(query, params)
+        export_path = create_parquet_export(reader.fetch_record_batch(EXPORT_BATCH_ROWS))
+        filename = generate_filename(server, record_type, 'parquet', timestamp)
+        mimetype = 'application/vnd.apache.parquet'
+        
+    elif format_type == 'excel':
+        # Rows stream straight from the cursor into the sheet
+        excel_query = f"SELECT {EXPORT_ROW_SQL} FROM domains WHERE {filter_sql} ORDER BY fetched_at DESC"
+        reader = conn.execute(excel_query, params)
+        export_path = create_excel_export(reader.fetch_record_batch(SHEET_BATCH_ROWS), total_results, server, record_type)
         filename = generate_filename(server, record_type, 'xlsx', timestamp)
         mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         
-    elif format_type == 'csv_chunked' or len(results) > 100000:
-        file_buffer = create_chunked_csv_export(results, server, record_type)
-        filename = generate_filename(server, record_type, 'zip', timestamp)
-        mimetype = 'application/zip'
+    elif format_type == 'csv_chunked' or total_results > 100000:
+        export_path = create_chunked_csv_export(conn, filter_sql, params, total_results, server, record_type)
+        
+        if isinstance(export_path, str):  # Small enough for a single CSV
+            filename = generate_filename(server, record_type, 'csv', timestamp)
+            mimetype = 'text/csv'
+        else:
+            filename = generate_filename(server, record_type, 'zip', timestamp)
+            return Response(
+                export_path,
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
         
-    else:  # Single CSV
-        file_buffer = create_single_csv_export(results)
+    else:  # Single CSV - record batches go straight to Arrow's CSV writer
+        reader = conn.execute(query, params)
+        export_path = create_single_csv_export(reader.fetch_record_batch(EXPORT_BATCH_ROWS))
         filename = generate_filename(server, record_type, 'csv', timestamp)
         mimetype = 'text/csv'
     
+    # Export files live on disk only until the response has been built
+    @after_this_request
+    def remove_export_file(response):
+        try:
+            os.unlink(export_path)
+        except OSError as e:
+            logger.warning(f"Could not remove export file {export_path}: {e}")
+        return response
+    
     return send_file(
-        file_buffer,
+        export_path,
         as_attachment=True,
         download_name=filename,
         mimetype=mimetype
@@ -901,13 +1587,31 @@ def export():
 def api_stats():
     """API endpoint for live stats."""
     stats = get_database_stats()
-    return jsonify(stats)
+    
+    # Pollers that already hold the current stats get an empty 304 back
+    response = jsonify(stats)
+    response.add_etag()
+    response.cache_control.max_age = STATS_CACHE_TTL
+    return response.make_conditional(request)
+
+def orjson_response(payload):
+    """Serialize a JSON response with orjson instead of Flask's default encoder."""
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+# Successful /test_viewdns probes are reused for this long (each one costs an API call)
+VIEWDNS_TEST_CACHE_TTL = 300  # seconds
+_viewdns_test_cache = None  # (expires_at, payload)
 
 @app.route('/test_viewdns')
 def test_viewdns():
     """Test ViewDNS API response format."""
+    global _viewdns_test_cache
     if not VIEWDNS_API_KEY:
-        return jsonify({'error': 'ViewDNS API key not configured'})
+        return orjson_response({'error': 'ViewDNS API key not configured'})
+    
+    cached = _viewdns_test_cache
+    if cached and cached[0] > time.monotonic():
+        return orjson_response(cached[1])
     
     api = ViewDNSAPI(VIEWDNS_API_KEY)
     
@@ -917,76 +1621,127 @@ def test_viewdns():
     
     try:
         # Make raw API request to see response format
-        url = f"{api.base_url}/reversemx/"
-        params = {
-            'mx': test_server,
-            'apikey': api.api_key,
-            'output': 'json',
-            'page': 1
-        }
-        
-        response = requests.get(url, params=params, timeout=30)
-        logger.info(f"Raw response status: {response.status_code}")
-        logger.info(f"Raw response headers: {dict(response.headers)}")
-        logger.info(f"Raw response text (first 500 chars): {response.text[:500]}")
+        params = {**api.base_params, 'mx': test_server, 'page': 1}
+        
+        response = api.session.get(api.reverse_mx_url, params=params, timeout=VIEWDNS_TIMEOUT)
+        # Preview slices decode only the bytes shown, not the whole body
+        raw_preview = response.content[:1000].decode('utf-8', 'replace')
+        # Formatting is deferred to the logging framework and skipped when the level is off
+        logger.info("Raw response status: %s", response.status_code)
+        logger.debug("Raw response headers: %s", response.headers)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Raw response text (first 500 chars): %s", raw_preview[:500])
+        
+        if not looks_like_json(response.content):
+            return orjson_response({
+                'success': False,
+                'error': 'Non-JSON response',
+                'raw_response': raw_preview
+            })
         
         # Try to parse as JSON
         try:
-            data = response.json()
-            logger.info(f"Parsed JSON structure: {type(data)} - Keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-            return jsonify({
+            data = orjson.loads(response.content)
+            data_keys = list(data) if isinstance(data, dict) else None
+            logger.info("Parsed JSON structure: %s - Keys: %s", type(data), data_keys if data_keys is not None else 'Not a dict')
+            payload = {
                 'success': True,
                 'status_code': response.status_code,
                 'content_type': response.headers.get('content-type'),
                 'data_type': str(type(data)),
-                'data_keys': list(data.keys()) if isinstance(data, dict) else None,
-                'raw_response': response.text[:1000]
-            })
-        except ValueError as e:
-            return jsonify({
+                'data_keys': data_keys,
+                'raw_response': raw_preview
+            }
+            if response.ok:
+                _viewdns_test_cache = (time.monotonic() + VIEWDNS_TEST_CACHE_TTL, payload)
+            return orjson_response(payload)
+        except orjson.JSONDecodeError as e:
+            return orjson_response({
                 'success': False,
                 'error': f'JSON parse error: {e}',
-                'raw_response': response.text[:1000]
+                'raw_response': raw_preview
             })
             
-    except Exception as e:
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        # The common failure - report it without formatting the whole exception chain
+        logger.warning(f"ViewDNS test network error: {e.__class__.__name__}")
+        return orjson_response({'error': 'network', 'detail': e.__class__.__name__}), 504
+    except requests.exceptions.RequestException as e:
         logger.error(f"ViewDNS test error: {e}")
-        return jsonify({'error': str(e)})
+        return orjson_response({'error': str(e)}), 502
 
 @app.route('/progress/<session_id>')
 def progress(session_id):
     """Get harvest progress for a session."""
-    progress_data = harvest_progress.get(session_id, {})
-    return jsonify(progress_data)
+    progress_data = get_harvest_progress(session_id)
+    return orjson_response(progress_data)
+
+@app.route('/progress')
+def progress_batch():
+    """Get harvest progress for several sessions in one poll (?ids=a,b,c)."""
+    snapshot = progress_snapshot
+    session_ids = [session_id for session_id in request.args.get('ids', '').split(',') if session_id]
+    return orjson_response({session_id: snapshot.get(session_id, {}) for session_id in session_ids})
+
+@app.route('/maintenance/compact', methods=['POST'])
+def compact_database():
+    """Reorder and compact the domains table (refused while harvests are running)."""
+    try:
+        if not maintain_domains_storage():
+            return jsonify({
+                'success': False,
+                'error': 'Harvests are running. Try again once they have finished.'
+            }), 409
+    except Exception as e:
+        logger.error(f"Error compacting database: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Failed to compact database: {str(e)}'
+        }), 500
+    
+    logger.info("Domains table reordered and compacted")
+    return jsonify({
+        'success': True,
+        'message': 'Domains table reordered and compacted.'
+    })
 
 @app.route('/clear-database', methods=['POST'])
 def clear_database():
     """Safely clear all data from the database while preserving structure."""
     try:
-        conn = duckdb.connect(DATABASE)
-        
-        # Get counts before clearing
-        domains_count = conn.execute('SELECT COUNT(*) FROM domains').fetchone()[0]
-        sessions_count = conn.execute('SELECT COUNT(*) FROM harvest_sessions').fetchone()[0]
-        
-        # Clear all data from tables (but keep the structure)
-        conn.execute('DELETE FROM domains')
-        conn.execute('DELETE FROM harvest_sessions')
+        conn = get_db()
         
-        # Reset sequence for DuckDB (DuckDB uses different syntax)
-        try:
-            conn.execute('DROP SEQUENCE IF EXISTS domains_id_seq')
-            conn.execute('CREATE SEQUENCE domains_id_seq START 1')
-        except Exception as seq_error:
-            # If sequence operations fail, just continue - the main clearing still worked
-            logger.warning(f"Could not reset sequence: {seq_error}")
-        
-        conn.close()
-        
-        # Clear any active harvest progress tracking
-        global harvest_progress, harvest_threads
-        harvest_progress.clear()
-        harvest_threads.clear()
+        # harvest_lock is held throughout so no harvest starts while the tables are emptied
+        with harvest_lock:
+            # Running harvests stay registered - maintain_domains_storage relies on them
+            if any(thread.is_alive() for thread in harvest_threads.values()):
+                return jsonify({
+                    'success': False,
+                    'error': 'Harvests are running. Try again once they have finished.'
+                }), 409
+            
+            # Count and clear in one transaction so the reported numbers match what was removed
+            with db_write_lock:
+                conn.begin()
+                try:
+                    domains_count = conn.execute('SELECT COUNT(*) FROM domains').fetchone()[0]
+                    sessions_count = conn.execute('SELECT COUNT(*) FROM harvest_sessions').fetchone()[0]
+                    
+                    # Clear all data from tables (but keep the structure)
+                    conn.execute('TRUNCATE TABLE domains')
+                    conn.execute('TRUNCATE TABLE harvest_sessions')
+                    conn.execute('TRUNCATE TABLE server_counts')
+                    conn.execute('TRUNCATE TABLE unique_domains')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            
+            # Drop the progress tracking of the finished harvests
+            harvest_progress.clear()
+            harvest_threads.clear()
+            publish_harvest_progress()
+        invalidate_stats_cache()
         
         logger.info(f"Database cleared successfully. Removed {domains_count} domains and {sessions_count} sessions")
         
@@ -1004,6 +1759,18 @@ def clear_database():
             'error': f'Failed to clear database: {str(e)}'
         }), 500
 
+def create_wsgi_app():
+    """Entry point for production WSGI servers: gunicorn 'app:create_wsgi_app()'."""
+    init_db()
+    return app
+
 if __name__ == '__main__':
     init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Each request gets its own thread, so slow exports and ViewDNS probes never queue
+    # behind one another. Debug mode (and its reloader) only with FLASK_ENV=development.
+    app.run(
+        debug=os.getenv('FLASK_ENV') == 'development',
+        threaded=True,
+        host='0.0.0.0',
+        port=5000
+    )
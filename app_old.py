@@ -1,16 +1,31 @@
 import os
 import sqlite3
 import time
+import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash
+from itertools import repeat
+from collections import OrderedDict
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, stream_with_context
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import csv
 import io
+import base64
+import logging
+import weakref
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
 
@@ -18,274 +33,583 @@ app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
 API_KEY = os.getenv('SECURITYTRAILS_API_KEY')
 API_BASE_URL = 'https://api.securitytrails.com/v1'
 
+def create_securitytrails_session():
+    """Build the pooled keep-alive session used for every SecurityTrails request.
+    
+    A crawl makes thousands of calls to the same host, so they share TLS
+    connections instead of handshaking per request.
+    """
+    session = requests.Session()
+    session.headers.update({
+        'APIKEY': API_KEY,
+        'Content-Type': 'application/json'
+    })
+    # 429/5xx answers are retried with exponential backoff. The list/search POSTs
+    # are read-only queries, so they are safe to retry too.
+    retries = Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount('https://', adapter)
+    return session
+
+securitytrails_session = create_securitytrails_session()
+
+# SecurityTrails allows 5 requests per second per key
+SECURITYTRAILS_RATE = 5
+
+# Hostname patterns the bypass crawler fetches at once
+ALPHABET_WORKERS = 8
+
+# Below this many remaining calls (or on a 429) the limiter runs at half rate for a while
+RATE_LIMIT_LOW_WATER = 5
+RATE_BACKOFF_SECONDS = 10
+
+class RateLimiter:
+    """Thread-safe token bucket: `rate` calls per second, bursts of up to `burst`.
+    
+    Drops to half rate for RATE_BACKOFF_SECONDS whenever a response shows the
+    API's quota running low, so we slow down before the 429s start.
+    """
+    
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+        self.slow_until = 0.0
+    
+    def wait(self):
+        """Block until the caller's request slot is due."""
+        with self.lock:
+            now = time.monotonic()
+            interval = self.interval * 2 if now < self.slow_until else self.interval
+            # Unused slots accumulate up to `burst` - the bucket's tokens
+            slot = max(self.next_slot, now - (self.burst - 1) * interval)
+            self.next_slot = slot + interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def observe(self, response, *args, **kwargs):
+        """Response hook: back off when the API is throttling or nearly out of quota."""
+        throttled = response.status_code == 429
+        if not throttled:
+            try:
+                throttled = int(response.headers.get('X-RateLimit-Remaining', RATE_LIMIT_LOW_WATER)) < RATE_LIMIT_LOW_WATER
+            except ValueError:
+                pass
+        if throttled:
+            with self.lock:
+                self.slow_until = time.monotonic() + RATE_BACKOFF_SECONDS
+
+securitytrails_limiter = RateLimiter(SECURITYTRAILS_RATE, burst=SECURITYTRAILS_RATE)
+securitytrails_session.hooks['response'].append(securitytrails_limiter.observe)
+
 # Database configuration
 DATABASE = 'domains.db'
 
+# Rows pulled from SQLite per fetch while streaming an export
+EXPORT_FETCH_ROWS = 10000
+
+# Fetchers hold new domains in memory and write them this many rows per transaction
+INSERT_BATCH_ROWS = 5000
+
+def connect_db():
+    """Open a SQLite connection with the per-connection performance PRAGMAs applied."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)  # closed at exit from the main thread
+    # WAL only needs a fsync at checkpoints, so NORMAL is still crash-safe
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 MB memory-mapped reads
+    return conn
+
+# One long-lived connection per thread instead of reopening the database file per call
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+
+def get_db():
+    """Return the calling thread's SQLite connection, opening it on first use."""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = connect_db()
+        _db_local.conn = conn
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+@atexit.register
+def close_db_connections():
+    """Close every per-thread connection at interpreter shutdown."""
+    with _db_connections_lock:
+        for conn in _db_connections:
+            conn.close()
+        _db_connections.clear()
+
+DOMAINS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domain TEXT NOT NULL,
+        mx TEXT,
+        ns TEXT,
+        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+def migrate_domains_unique_key(conn):
+    """Rebuild a legacy domains table without its UNIQUE(domain, mx, ns) constraint.
+    
+    NULLs never compare equal, so that constraint could not reject a repeated
+    (domain, host) row - one of mx/ns is always NULL - yet every insert still paid
+    for its three-column index. Repeats stored under it are collapsed on the way.
+    """
+    logger.info("Migrating domains table: replacing UNIQUE(domain, mx, ns) with per-host keys")
+    with conn:
+        conn.execute(DOMAINS_TABLE_SQL.format(name='domains_rebuilt'))
+        conn.execute('''
+            INSERT INTO domains_rebuilt (id, domain, mx, ns, fetched_at)
+            SELECT id, domain, mx, ns, fetched_at FROM domains WHERE id IN (
+                SELECT MIN(id) FROM domains GROUP BY domain, mx, ns
+            )
+        ''')
+        conn.execute('DROP TABLE domains')
+        conn.execute('ALTER TABLE domains_rebuilt RENAME TO domains')
+
 def init_db():
     """Initialize the SQLite database with required tables and indexes."""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
+    # WAL lets readers run alongside the writer. The mode is stored in the database
+    # file, so this is a one-off; SQLite keeps domains.db-wal / domains.db-shm beside it.
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # Create domains table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS domains (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            domain TEXT NOT NULL,
-            mx TEXT,
-            ns TEXT,
-            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(domain, mx, ns)
-        )
-    ''')
-    
-    # Create indexes for faster queries
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_mx ON domains(mx)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ns ON domains(ns)')
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'domains'")
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(DOMAINS_TABLE_SQL.format(name='domains'))
+    elif 'UNIQUE(domain, mx, ns)' in row[0]:
+        migrate_domains_unique_key(conn)
+    
+    for name in ('idx_mx', 'idx_ns', 'idx_mx_fetched', 'idx_ns_fetched',
+                 'idx_mx_fetched_cov', 'idx_ns_fetched_cov', 'idx_domain_host'):
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    
+    # Every row belongs to exactly one host column, so each index only covers the rows
+    # with that column set: an insert touches one unique and one covering index.
+    # (mx = ? implies mx IS NOT NULL, which lets SQLite use the partial indexes.)
+    #
+    # Uniqueness is per (domain, host).
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_mx_domain ON domains(domain, mx) WHERE mx IS NOT NULL')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_ns_domain ON domains(domain, ns) WHERE ns IS NOT NULL')
+    
+    # Covering indexes: a host lookup walks (fetched_at, id) backwards and reads
+    # domain/ns straight from the index, so pages and exports need no sort step
+    # and no table lookups. They also serve the plain mx = ? / ns = ? lookups.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_mx_cov ON domains(mx, fetched_at, id, domain, ns) WHERE mx IS NOT NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ns_cov ON domains(ns, fetched_at, id, domain, mx) WHERE ns IS NOT NULL')
     
     conn.commit()
-    conn.close()
+
+def build_host_queries(column):
+    """SQL for one record type, built once so no query has to branch on mx vs ns."""
+    return {
+        'exists': f'SELECT 1 FROM domains WHERE {column} = ? LIMIT 1',
+        'count': f'SELECT COUNT(*) FROM domains WHERE {column} = ?',
+        # The uncorrelated count subquery runs once and rides along on every row. (A
+        # COUNT(*) OVER () window would materialise the matches and re-sort them.)
+        'page': f'''
+            SELECT domain, mx, ns, fetched_at,
+                   (SELECT COUNT(*) FROM domains WHERE {column} = ?1), id FROM domains 
+            WHERE {column} = ?1 
+            ORDER BY fetched_at DESC, id DESC 
+            LIMIT ?2 OFFSET ?3
+        ''',
+        'seek': f'''
+            SELECT domain, mx, ns, fetched_at,
+                   (SELECT COUNT(*) FROM domains WHERE {column} = ?1), id FROM domains 
+            WHERE {column} = ?1 AND (fetched_at, id) < (?2, ?3)
+            ORDER BY fetched_at DESC, id DESC 
+            LIMIT ?4
+        ''',
+        'export': f'''
+            SELECT domain, mx, ns, fetched_at FROM domains 
+            WHERE {column} = ? 
+            ORDER BY fetched_at DESC
+        ''',
+    }
+
+HOST_QUERIES = {'mx': build_host_queries('mx'), 'ns': build_host_queries('ns')}
+
+def host_queries(record_type):
+    """The prepared SQL for a record type (anything but 'mx' is treated as ns)."""
+    return HOST_QUERIES['mx' if record_type == 'mx' else 'ns']
+
+# Hosts known to have stored rows, most recently checked last - bounded, guarded by the lock.
+# Rows are never deleted, so a positive answer stays true; entries only expire to keep
+# the map small. Negative answers are not cached: the caller fetches straight after one.
+HOST_CACHE_SIZE = 4096
+HOST_CACHE_TTL = 60  # seconds
+_cached_hosts = OrderedDict()  # (record_type, host) -> expires_at
+_cached_hosts_lock = threading.Lock()
 
 def check_cache(record_type, host):
     """Check if we have cached data for the given type and host."""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    key = (record_type, host)
+    now = time.monotonic()
+    with _cached_hosts_lock:
+        expires_at = _cached_hosts.get(key)
+        if expires_at is not None and expires_at > now:
+            return True
+    
+    cursor = get_db().cursor()
+    cursor.execute(host_queries(record_type)['exists'], (host,))
+    if cursor.fetchone() is None:
+        return False
+    
+    with _cached_hosts_lock:
+        _cached_hosts[key] = now + HOST_CACHE_TTL
+        _cached_hosts.move_to_end(key)
+        while len(_cached_hosts) > HOST_CACHE_SIZE:
+            _cached_hosts.popitem(last=False)
+    return True
+
+# Refresh storms: fetches of one host are serialized, and a host fetched this recently is
+# served from the database rather than crawled again. Fetch times are bounded like
+# _cached_hosts; the per-host locks disappear once no request holds them.
+REFRESH_MIN_INTERVAL = 300  # seconds
+_host_fetch_locks = weakref.WeakValueDictionary()
+_host_fetched_at = OrderedDict()  # (record_type, host) -> monotonic time of the last fetch
+_host_fetch_state_lock = threading.Lock()
+
+def host_fetch_lock(record_type, host):
+    """The lock that serializes API fetches of one host."""
+    key = (record_type, host)
+    with _host_fetch_state_lock:
+        lock = _host_fetch_locks.get(key)
+        if lock is None:
+            lock = _host_fetch_locks[key] = threading.Lock()
+        return lock
+
+def fetched_recently(record_type, host):
+    """Whether the host was fetched from the API within REFRESH_MIN_INTERVAL."""
+    with _host_fetch_state_lock:
+        fetched_at = _host_fetched_at.get((record_type, host))
+    return fetched_at is not None and time.monotonic() - fetched_at < REFRESH_MIN_INTERVAL
+
+def mark_fetched(record_type, host):
+    """Record that the host has just been fetched from the API."""
+    key = (record_type, host)
+    with _host_fetch_state_lock:
+        _host_fetched_at[key] = time.monotonic()
+        _host_fetched_at.move_to_end(key)
+        while len(_host_fetched_at) > HOST_CACHE_SIZE:
+            _host_fetched_at.popitem(last=False)
+
+def record_hostnames(records):
+    """Hostnames from a page of SecurityTrails records, skipping records without one."""
+    return [record['hostname'] for record in records if record.get('hostname')]
+
+def insert_domains_sqlite(domains, record_type, host):
+    """Insert domains for one host in a single transaction, skipping duplicates.
     
+    Returns how many rows were actually new.
+    """
+    # Row tuples are zipped together in C rather than built per domain in Python
+    now = repeat(datetime.now())
     if record_type == 'mx':
-        cursor.execute('SELECT COUNT(*) FROM domains WHERE mx = ?', (host,))
+        rows = zip(domains, repeat(host), repeat(None), now)
     else:  # ns
-        cursor.execute('SELECT COUNT(*) FROM domains WHERE ns = ?', (host,))
-    
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count > 0
-
-def insert_into_sqlite(domain, mx=None, ns=None):
-    """Insert a domain record into SQLite, skipping duplicates."""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+        rows = zip(domains, repeat(None), repeat(host), now)
     
+    conn = get_db()
     try:
-        cursor.execute('''
-            INSERT OR IGNORE INTO domains (domain, mx, ns, fetched_at)
-            VALUES (?, ?, ?, ?)
-        ''', (domain, mx, ns, datetime.now()))
-        conn.commit()
+        with conn:
+            # Ignored duplicates don't count towards rowcount
+            return conn.executemany('''
+                INSERT INTO domains (domain, mx, ns, fetched_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            ''', rows).rowcount
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    finally:
-        conn.close()
+        logger.error("Database error: %s", e)
+        return 0
 
-def query_sqlite(record_type, host, page=1, limit=50):
-    """Query SQLite for paginated results."""
-    conn = sqlite3.connect(DATABASE)
+class DomainBuffer:
+    """Collect a fetch's domains and insert them INSERT_BATCH_ROWS at a time.
+    
+    Duplicates are left to the unique index and `inserted` counts the rows that
+    were actually new, so memory stays bounded by one batch however many domains
+    the host has. Call flush() once the fetch is done to write the tail.
+    """
+    
+    def __init__(self, record_type, host):
+        self.record_type = record_type
+        self.host = host
+        self.pending = []
+        self.inserted = 0
+    
+    def add(self, domains):
+        """Queue domains, writing them out once a full batch has built up."""
+        self.pending.extend(domains)
+        if len(self.pending) >= INSERT_BATCH_ROWS:
+            self.flush()
+    
+    def flush(self):
+        """Write the queued domains in one transaction."""
+        if self.pending:
+            self.inserted += insert_domains_sqlite(self.pending, self.record_type, self.host)
+            self.pending = []
+
+def encode_page_cursor(row):
+    """Opaque keyset token for the row a page ended on: its (fetched_at, id)."""
+    return base64.urlsafe_b64encode(f"{row[3]}|{row[5]}".encode()).decode()
+
+def decode_page_cursor(token):
+    """Inverse of encode_page_cursor - raises ValueError for a mangled token."""
+    fetched_at, _, row_id = base64.urlsafe_b64decode(token.encode()).decode().rpartition('|')
+    return fetched_at, int(row_id)
+
+def query_sqlite(record_type, host, page=1, limit=50, after=None):
+    """Query SQLite for one page of results plus the total match count.
+    
+    Given the previous page's `after` token the page is found by seeking the
+    covering (host, fetched_at, id) index instead of skipping OFFSET rows. Returns
+    (results, total_count, next_cursor).
+    """
+    conn = get_db()
     cursor = conn.cursor()
     
-    offset = (page - 1) * limit
-    
-    if record_type == 'mx':
-        cursor.execute('''
-            SELECT domain, mx, ns, fetched_at FROM domains 
-            WHERE mx = ? 
-            ORDER BY fetched_at DESC 
-            LIMIT ? OFFSET ?
-        ''', (host, limit, offset))
-    else:  # ns
-        cursor.execute('''
-            SELECT domain, mx, ns, fetched_at FROM domains 
-            WHERE ns = ? 
-            ORDER BY fetched_at DESC 
-            LIMIT ? OFFSET ?
-        ''', (host, limit, offset))
+    queries = host_queries(record_type)
     
-    results = cursor.fetchall()
+    seek = None
+    if after:
+        try:
+            seek = decode_page_cursor(after)
+        except ValueError:
+            pass  # stale or mangled token - fall back to OFFSET
     
-    # Get total count for pagination
-    if record_type == 'mx':
-        cursor.execute('SELECT COUNT(*) FROM domains WHERE mx = ?', (host,))
+    if seek:
+        cursor.execute(queries['seek'], (host, *seek, limit))
     else:
-        cursor.execute('SELECT COUNT(*) FROM domains WHERE ns = ?', (host,))
-    
-    total_count = cursor.fetchone()[0]
-    conn.close()
+        cursor.execute(queries['page'], (host, limit, (page - 1) * limit))
+    
+    rows = cursor.fetchall()
+    results = [row[:4] for row in rows]
+    next_cursor = encode_page_cursor(rows[-1]) if len(rows) == limit else None
+    
+    if rows:
+        total_count = rows[0][4]
+    elif page > 1:
+        # Past the last page there is no row to carry the total - count separately
+        cursor.execute(queries['count'], (host,))
+        total_count = cursor.fetchone()[0]
+    else:
+        total_count = 0
     
-    return results, total_count
+    return results, total_count, next_cursor
 
 def query_all_sqlite(record_type, host):
-    """Query all records for CSV export."""
-    conn = sqlite3.connect(DATABASE)
+    """Query all records for CSV export, returning the cursor to iterate."""
+    conn = get_db()
     cursor = conn.cursor()
+    cursor.arraysize = EXPORT_FETCH_ROWS
+    cursor.execute(host_queries(record_type)['export'], (host,))
     
-    if record_type == 'mx':
-        cursor.execute('''
-            SELECT domain, mx, ns, fetched_at FROM domains 
-            WHERE mx = ? 
-            ORDER BY fetched_at DESC
-        ''', (host,))
-    else:  # ns
-        cursor.execute('''
-            SELECT domain, mx, ns, fetched_at FROM domains 
-            WHERE ns = ? 
-            ORDER BY fetched_at DESC
-        ''', (host,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    return cursor
+
+# A successful ping is trusted this long, so /results doesn't probe before every search.
+# Failures are never cached - the next request probes again straight away.
+API_PROBE_TTL = 60  # seconds
+_api_probe_ok_until = 0.0
 
-def test_api_connection():
+def test_api_connection(use_cache=True):
     """Test API connection and authentication."""
+    global _api_probe_ok_until
+    
     if not API_KEY:
         return False, "API key not configured"
     
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
+    if use_cache and time.monotonic() < _api_probe_ok_until:
+        return True, "API connection successful"
     
     try:
         # Test with ping endpoint first
         ping_url = f"{API_BASE_URL}/ping"
-        response = requests.get(ping_url, headers=headers, timeout=10)
+        response = securitytrails_session.get(ping_url, timeout=10)
         
         if response.status_code == 200:
+            _api_probe_ok_until = time.monotonic() + API_PROBE_TTL
             return True, "API connection successful"
         else:
             return False, f"API ping failed: {response.status_code} - {response.text}"
     except Exception as e:
         return False, f"API connection error: {str(e)}"
 
+# DSL search endpoints, tried in order until one accepts the query
+DSL_ENDPOINTS = [
+    f"{API_BASE_URL}/search/list",         # From documentation examples
+    f"{API_BASE_URL}/domains/list-backup"  # From API reference
+]
+
+# Correct scroll endpoint from official documentation
+OFFICIAL_SCROLL_URL = f"{API_BASE_URL}/domains/list?include_ips=false&page=1&scroll=true"
+
+# Batches a single scroll may run to, counting the first one
+MAX_SCROLL_BATCHES = 500  # Increased limit for large datasets
+
+class ScrollUnavailable(Exception):
+    """The endpoint rejected the query that should have started a scroll."""
+
+def host_dsl_query(record_type, host):
+    """Proper DSL query syntax for a host's MX or NS records."""
+    if record_type == 'mx':
+        return f"mx = '{host}'"
+    else:  # ns
+        return f"ns = '{host}'"
+
+def domains_list_body(filter_params, **fixed):
+    """Serialize a paged /domains/list body once; returns page -> JSON bytes.
+    
+    Only the page number changes between requests, so it is spliced onto the
+    pre-encoded filter instead of re-serializing the whole dict every page.
+    """
+    prefix = orjson.dumps({'filter': filter_params, 'scroll': False, **fixed})[:-1] + b',"page":'
+    return lambda page: prefix + str(page).encode() + b'}'
+
+def read_scroll_id(data, scroll_id_in_meta):
+    """The next scroll id - /domains/list nests it under meta, the DSL endpoints don't."""
+    if scroll_id_in_meta:
+        return data.get('meta', {}).get('scroll_id')
+    return data.get('scroll_id')
+
+def scroll_pages(endpoint_url, body, scroll_id_in_meta):
+    """Yield each page of records from one SecurityTrails scroll search.
+    
+    The POST of the already serialized `body` starts the scroll and /scroll/<id>
+    continues it until the API runs dry. Raises ScrollUnavailable if the endpoint
+    rejects the query.
+    """
+    securitytrails_limiter.wait()
+    response = securitytrails_session.post(endpoint_url, data=body, timeout=30)
+    
+    logger.debug("Scroll start status from %s: %s", endpoint_url, response.status_code)
+    
+    if response.status_code != 200:
+        raise ScrollUnavailable(f'{response.status_code} - {response.text}')
+    
+    data = orjson.loads(response.content)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Scroll response keys: %s", list(data.keys()))
+    
+    records = data.get('records', [])
+    scroll_id = read_scroll_id(data, scroll_id_in_meta)
+    meta = data.get('meta', {})
+    
+    logger.debug("First batch: %s records", len(records))
+    logger.debug("Scroll ID: %s", scroll_id)
+    logger.debug("Meta info: %s", meta)
+    
+    yield records
+    
+    # Check if there are more results available
+    total_records = meta.get('total_records', 0)
+    logger.info("Total available records according to meta: %s", total_records)
+    
+    if not scroll_id:
+        logger.info("No scroll_id returned - may be all results in first batch")
+        return
+    if total_records <= len(records):
+        logger.info("Scroll available but no additional records indicated in meta")
+        return
+    
+    logger.info("Starting scroll to fetch %s more records...", total_records - len(records))
+    received = len(records)
+    
+    for batch in range(2, MAX_SCROLL_BATCHES + 1):
+        # Once meta's total is in hand the scroll is done - don't spend a call on an empty batch
+        if received >= total_records:
+            logger.info("All %s records received", total_records)
+            return
+        
+        securitytrails_limiter.wait()
+        scroll_response = securitytrails_session.get(f"{API_BASE_URL}/scroll/{scroll_id}", timeout=30)
+        
+        if scroll_response.status_code != 200:
+            logger.warning("Scroll ended: %s - %s", scroll_response.status_code, scroll_response.text)
+            return
+        
+        scroll_data = orjson.loads(scroll_response.content)
+        records = scroll_data.get('records', [])
+        scroll_id = read_scroll_id(scroll_data, scroll_id_in_meta)
+        
+        logger.debug("Scroll batch %s: %s records, next scroll_id: %s", batch, len(records), 'Yes' if scroll_id else 'No')
+        
+        if not records:
+            logger.info("No more records in scroll")
+            return
+        
+        received += len(records)
+        yield records
+        
+        if not scroll_id:
+            return
+
+def scroll_into(buffer, endpoints, request_body, scroll_id_in_meta):
+    """Scroll the first endpoint that accepts the query into `buffer`.
+    
+    Returns (endpoint_url, records_fetched); endpoint_url is None when every
+    endpoint failed.
+    """
+    # Serialized once for every endpoint tried (the session already sends Content-Type: application/json)
+    body = orjson.dumps(request_body)
+    fetched = 0
+    for endpoint_url in endpoints:
+        try:
+            for batch, records in enumerate(scroll_pages(endpoint_url, body, scroll_id_in_meta), 1):
+                domains = record_hostnames(records)
+                buffer.add(domains)
+                fetched += len(domains)
+                
+                # Progress update every 10 batches
+                if batch % 10 == 0:
+                    logger.info("Progress: %s records fetched so far...", fetched)
+            return endpoint_url, fetched
+        except Exception as e:
+            logger.warning("Error with endpoint %s: %s", endpoint_url, e)
+    return None, fetched
+
 def fetch_reverse_records_with_scroll(record_type, host):
     """Fetch reverse records using DSL API with scroll for unlimited results."""
     if not API_KEY:
         flash('SecurityTrails API key not configured', 'error')
         return
     
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    new_records = 0
-    
-    # Try multiple DSL endpoints
-    dsl_endpoints = [
-        f"{API_BASE_URL}/search/list",         # From documentation examples
-        f"{API_BASE_URL}/domains/list-backup"  # From API reference
-    ]
-    
-    # Construct proper DSL query syntax
-    if record_type == 'mx':
-        dsl_query = f"mx = '{host}'"
-    else:  # ns
-        dsl_query = f"ns = '{host}'"
+    buffer = DomainBuffer(record_type, host)
     
+    dsl_query = host_dsl_query(record_type, host)
     request_body = {
         'query': dsl_query,
         'scroll': True,
         'include_inactive': False
     }
     
-    print(f"Trying DSL API with query: {dsl_query}")
+    logger.info("Trying DSL API with query: %s", dsl_query)
     
-    # Try each endpoint until one works
-    for endpoint_url in dsl_endpoints:
-        try:
-            print(f"Trying DSL endpoint: {endpoint_url}")
-            
-            time.sleep(0.2)
-            response = requests.post(endpoint_url, headers=headers, json=request_body, timeout=30)
-            
-            print(f"DSL Response status: {response.status_code}")
-            
-            if response.status_code == 404:
-                print(f"Endpoint {endpoint_url} not found, trying next...")
-                continue
-            elif response.status_code != 200:
-                error_msg = f'DSL API Error: {response.status_code} - {response.text}'
-                print(error_msg)
-                continue
-            
-            # Success! Process the response
-            data = response.json()
-            print(f"DSL Response keys: {list(data.keys())}")
-            
-            records = data.get('records', [])
-            scroll_id = data.get('scroll_id')
-            meta = data.get('meta', {})
-            
-            print(f"DSL first batch: {len(records)} records")
-            print(f"Scroll ID: {scroll_id}")
-            print(f"Meta info: {meta}")
-            
-            # Insert records
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
-            
-            # Check if there are more results available
-            total_records = meta.get('total_records', 0)
-            print(f"Total available records according to meta: {total_records}")
-            
-            # Continue with scroll if available and there are more records
-            if scroll_id and total_records > len(records):
-                print(f"Starting scroll to fetch {total_records - len(records)} more records...")
-                batch_count = 1
-                
-                while scroll_id and batch_count < 500:  # Increased limit for large datasets
-                    print(f"DSL scroll batch {batch_count + 1}...")
-                    
-                    time.sleep(0.2)
-                    
-                    scroll_url = f"{API_BASE_URL}/scroll/{scroll_id}"
-                    scroll_response = requests.get(scroll_url, headers=headers, timeout=30)
-                    
-                    print(f"Scroll response status: {scroll_response.status_code}")
-                    
-                    if scroll_response.status_code != 200:
-                        print(f"DSL scroll ended: {scroll_response.status_code} - {scroll_response.text}")
-                        break
-                    
-                    scroll_data = scroll_response.json()
-                    scroll_records = scroll_data.get('records', [])
-                    scroll_id = scroll_data.get('scroll_id')
-                    
-                    print(f"Scroll batch {batch_count + 1}: {len(scroll_records)} records, next scroll_id: {'Yes' if scroll_id else 'No'}")
-                    
-                    if not scroll_records:
-                        print("No more records in DSL scroll")
-                        break
-                    
-                    for record in scroll_records:
-                        domain = record.get('hostname', '')
-                        if domain:
-                            if record_type == 'mx':
-                                insert_into_sqlite(domain, mx=host, ns=None)
-                            else:
-                                insert_into_sqlite(domain, mx=None, ns=host)
-                            new_records += 1
-                    
-                    batch_count += 1
-                    
-                    # Progress update every 10 batches
-                    if batch_count % 10 == 0:
-                        print(f"Progress: {new_records} records fetched so far...")
-            
-            elif not scroll_id:
-                print("No scroll_id returned - may be all results in first batch")
-            else:
-                print("Scroll available but no additional records indicated in meta")
-            
-            flash(f'DSL API Success: Fetched {new_records} records using {endpoint_url}', 'success')
-            return
-                
-        except Exception as e:
-            print(f"Error with endpoint {endpoint_url}: {e}")
-            continue
+    endpoint_url, new_records = scroll_into(buffer, DSL_ENDPOINTS, request_body, scroll_id_in_meta=False)
+    buffer.flush()
+    
+    if endpoint_url:
+        flash(f'DSL API Success: Fetched {new_records} records using {endpoint_url}', 'success')
+        return
     
     # All DSL endpoints failed, fallback to enhanced standard API
     flash('DSL API not available. Using enhanced standard API...', 'warning')
@@ -297,296 +621,125 @@ def fetch_reverse_records_enhanced(record_type, host):
         flash('SecurityTrails API key not configured', 'error')
         return
     
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
+    buffer = DomainBuffer(record_type, host)
+    query = host_dsl_query(record_type, host)
     
-    new_records = 0
-    
-    # Use correct scroll endpoint from official documentation
-    scroll_url = f"{API_BASE_URL}/domains/list?include_ips=false&page=1&scroll=true"
-    
-    # Construct proper query syntax as shown in docs
-    if record_type == 'mx':
-        query = f"mx = '{host}'"
-    else:  # ns
-        query = f"ns = '{host}'"
+    logger.info("Enhanced API using official scroll endpoint with query: %s", query)
     
-    request_body = {
-        'query': query
-    }
-    
-    print(f"Enhanced API using official scroll endpoint with query: {query}")
-    
-    try:
-        print(f"Trying official scroll endpoint: {scroll_url}")
-        
-        time.sleep(0.2)
-        response = requests.post(scroll_url, headers=headers, json=request_body, timeout=30)
-        
-        print(f"Scroll Response status: {response.status_code}")
-        
-        if response.status_code != 200:
-            error_msg = f'Scroll API Error: {response.status_code} - {response.text}'
-            print(error_msg)
-            # Fallback to DSL endpoints if the official scroll fails
-            print("Official scroll failed, trying alternative DSL endpoints...")
-        else:
-            # Success! Process the response
-            data = response.json()
-            print(f"Scroll Response keys: {list(data.keys())}")
-            
-            records = data.get('records', [])
-            scroll_id = data.get('meta', {}).get('scroll_id')
-            meta = data.get('meta', {})
-            
-            print(f"Official scroll first batch: {len(records)} records")
-            print(f"Scroll ID: {scroll_id}")
-            print(f"Meta info: {meta}")
-            
-            # Insert records
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
-            
-            # Check if there are more results available
-            total_records = meta.get('total_records', 0)
-            print(f"Total available records according to meta: {total_records}")
-            
-            # Continue with scroll if available and there are more records
-            if scroll_id and total_records > len(records):
-                print(f"Starting official scroll to fetch {total_records - len(records)} more records...")
-                batch_count = 1
-                
-                while scroll_id and batch_count < 500:  # Increased limit for large datasets
-                    print(f"Official scroll batch {batch_count + 1}...")
-                    
-                    time.sleep(0.2)
-                    
-                    scroll_endpoint = f"{API_BASE_URL}/scroll/{scroll_id}"
-                    scroll_response = requests.get(scroll_endpoint, headers=headers, timeout=30)
-                    
-                    print(f"Scroll response status: {scroll_response.status_code}")
-                    
-                    if scroll_response.status_code != 200:
-                        print(f"Official scroll ended: {scroll_response.status_code} - {scroll_response.text}")
-                        break
-                    
-                    scroll_data = scroll_response.json()
-                    scroll_records = scroll_data.get('records', [])
-                    scroll_id = scroll_data.get('meta', {}).get('scroll_id')
-                    
-                    print(f"Scroll batch {batch_count + 1}: {len(scroll_records)} records, next scroll_id: {'Yes' if scroll_id else 'No'}")
-                    
-                    if not scroll_records:
-                        print("No more records in official scroll")
-                        break
-                    
-                    for record in scroll_records:
-                        domain = record.get('hostname', '')
-                        if domain:
-                            if record_type == 'mx':
-                                insert_into_sqlite(domain, mx=host, ns=None)
-                            else:
-                                insert_into_sqlite(domain, mx=None, ns=host)
-                            new_records += 1
-                    
-                    batch_count += 1
-                    
-                    # Progress update every 10 batches
-                    if batch_count % 10 == 0:
-                        print(f"Enhanced Progress: {new_records} records fetched so far...")
-            
-            elif not scroll_id:
-                print("No scroll_id returned - may be all results in first batch")
-            else:
-                print("Scroll available but no additional records indicated in meta")
-            
-            flash(f'Enhanced Official Scroll Success: Fetched {new_records} records', 'success')
-            return
-                
-    except Exception as e:
-        print(f"Error with official scroll endpoint: {e}")
+    endpoint_url, new_records = scroll_into(buffer, [OFFICIAL_SCROLL_URL], {'query': query}, scroll_id_in_meta=True)
+    if endpoint_url:
+        buffer.flush()
+        flash(f'Enhanced Official Scroll Success: Fetched {new_records} records', 'success')
+        return
     
     # Fallback to alternative DSL endpoints
-    print("Trying alternative DSL endpoints...")
-    dsl_endpoints = [
-        f"{API_BASE_URL}/search/list",         # From documentation examples
-        f"{API_BASE_URL}/domains/list-backup"  # From API reference
-    ]
-    
-    # Alternative DSL request body
+    logger.info("Official scroll failed, trying alternative DSL endpoints with query: %s", query)
     alt_request_body = {
         'query': query,
         'scroll': True,
         'include_inactive': False
     }
     
-    print(f"Enhanced DSL API with query: {query}")
+    endpoint_url, fetched = scroll_into(buffer, DSL_ENDPOINTS, alt_request_body, scroll_id_in_meta=False)
+    new_records += fetched
+    if endpoint_url:
+        buffer.flush()
+        flash(f'Enhanced DSL API Success: Fetched {new_records} records using {endpoint_url}', 'success')
+        return
     
-    # Try each endpoint until one works
-    for endpoint_url in dsl_endpoints:
+    # All DSL endpoints failed, fallback to standard API with extended pages
+    logger.warning("All DSL endpoints failed, falling back to standard API with extended pagination...")
+    url = f"{API_BASE_URL}/domains/list"
+    
+    page_body = domains_list_body({'mx' if record_type == 'mx' else 'ns': host})
+    
+    # Try fetching beyond page 100 to see if the limit is enforced
+    for page in range(1, 201):  # Try up to 200 pages
         try:
-            print(f"Trying DSL endpoint: {endpoint_url}")
-            
-            time.sleep(0.2)
-            response = requests.post(endpoint_url, headers=headers, json=alt_request_body, timeout=30)
-            
-            print(f"DSL Response status: {response.status_code}")
+            securitytrails_limiter.wait()
+            response = securitytrails_session.post(url, data=page_body(page), timeout=30)
             
-            if response.status_code == 404:
-                print(f"Endpoint {endpoint_url} not found, trying next...")
-                continue
-            elif response.status_code != 200:
-                error_msg = f'DSL API Error: {response.status_code} - {response.text}'
-                print(error_msg)
-                continue
-            
-            # Success! Process the response
-            data = response.json()
-            print(f"DSL Response keys: {list(data.keys())}")
+            if response.status_code != 200:
+                logger.warning("Standard API fallback stopped at page %s: %s", page, response.status_code)
+                break
             
+            data = orjson.loads(response.content)
             records = data.get('records', [])
-            scroll_id = data.get('scroll_id')
-            meta = data.get('meta', {})
             
-            print(f"DSL first batch: {len(records)} records")
-            print(f"Scroll ID: {scroll_id}")
-            print(f"Meta info: {meta}")
+            if not records:
+                logger.debug("No more records at page %s", page)
+                break
             
-            # Insert records
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
+            # Check if we hit the max_page limit
+            meta = data.get('meta', {})
+            max_page = meta.get('max_page', 0)
             
-            # Check if there are more results available
-            total_records = meta.get('total_records', 0)
-            print(f"Total available records according to meta: {total_records}")
+            logger.debug("Standard API fallback page %s: %s records, max_page: %s", page, len(records), max_page)
             
-            # Continue with scroll if available and there are more records
-            if scroll_id and total_records > len(records):
-                print(f"Starting scroll to fetch {total_records - len(records)} more records...")
-                batch_count = 1
-                
-                while scroll_id and batch_count < 500:  # Increased limit for large datasets
-                    print(f"Enhanced DSL scroll batch {batch_count + 1}...")
-                    
-                    time.sleep(0.2)
-                    
-                    scroll_url = f"{API_BASE_URL}/scroll/{scroll_id}"
-                    scroll_response = requests.get(scroll_url, headers=headers, timeout=30)
-                    
-                    print(f"Scroll response status: {scroll_response.status_code}")
-                    
-                    if scroll_response.status_code != 200:
-                        print(f"Enhanced DSL scroll ended: {scroll_response.status_code} - {scroll_response.text}")
-                        break
-                    
-                    scroll_data = scroll_response.json()
-                    scroll_records = scroll_data.get('records', [])
-                    scroll_id = scroll_data.get('scroll_id')
-                    
-                    print(f"Scroll batch {batch_count + 1}: {len(scroll_records)} records, next scroll_id: {'Yes' if scroll_id else 'No'}")
-                    
-                    if not scroll_records:
-                        print("No more records in Enhanced DSL scroll")
-                        break
-                    
-                    for record in scroll_records:
-                        domain = record.get('hostname', '')
-                        if domain:
-                            if record_type == 'mx':
-                                insert_into_sqlite(domain, mx=host, ns=None)
-                            else:
-                                insert_into_sqlite(domain, mx=None, ns=host)
-                            new_records += 1
-                    
-                    batch_count += 1
-                    
-                    # Progress update every 10 batches
-                    if batch_count % 10 == 0:
-                        print(f"Enhanced Progress: {new_records} records fetched so far...")
-            
-            elif not scroll_id:
-                print("No scroll_id returned - may be all results in first batch")
-            else:
-                print("Scroll available but no additional records indicated in meta")
+            buffer.add(record_hostnames(records))
             
-            flash(f'Enhanced DSL API Success: Fetched {new_records} records using {endpoint_url}', 'success')
-            return
+            # Respect the API's max_page if set
+            if max_page and page >= max_page:
+                logger.info("Reached API max_page limit: %s", max_page)
+                break
                 
         except Exception as e:
-            print(f"Error with enhanced endpoint {endpoint_url}: {e}")
-            continue
+            logger.warning("Standard API fallback error at page %s: %s", page, e)
+            break
     
-    # All DSL endpoints failed, fallback to standard API with extended pages
-    print("All DSL endpoints failed, falling back to standard API with extended pagination...")
+    buffer.flush()
+    flash(f'Enhanced API (with fallback): Fetched {buffer.inserted} new records', 'success')
+
+def fetch_hostname_pattern(record_type, host, letter_pattern, stop):
+    """Page through one hostname pattern (each pattern has its own 100-page limit).
+    
+    Runs on an executor thread, so it only talks to the API and returns the
+    hostnames it found. Gives up early once `stop` is set.
+    """
     url = f"{API_BASE_URL}/domains/list"
     
-    # Try fetching beyond page 100 to see if the limit is enforced
-    for page in range(1, 201):  # Try up to 200 pages
-        if record_type == 'mx':
-            filter_params = {'mx': host}
-        else:
-            filter_params = {'ns': host}
-        
-        request_body = {
-            'filter': filter_params,
-            'page': page,
-            'scroll': False
-        }
+    page_body = domains_list_body({'mx' if record_type == 'mx' else 'ns': host, 'hostname': letter_pattern})
+    
+    hostnames = []
+    consecutive_empty = 0
+    
+    for page in range(1, 101):  # Full 100 pages per pattern
+        if stop.is_set():
+            break
         
         try:
-            time.sleep(0.2)
-            response = requests.post(url, headers=headers, json=request_body, timeout=30)
+            securitytrails_limiter.wait()
+            response = securitytrails_session.post(url, data=page_body(page), timeout=30)
             
             if response.status_code != 200:
-                print(f"Standard API fallback stopped at page {page}: {response.status_code}")
                 break
             
-            data = response.json()
+            data = orjson.loads(response.content)
             records = data.get('records', [])
             
+            # The first page doubles as a probe: a pattern with nothing there has no
+            # matches at all (most of them, on quiet hosts), so don't spend a second call
             if not records:
-                print(f"No more records at page {page}")
-                break
-            
-            # Check if we hit the max_page limit
-            meta = data.get('meta', {})
-            max_page = meta.get('max_page', 0)
-            
-            print(f"Standard API fallback page {page}: {len(records)} records, max_page: {max_page}")
+                consecutive_empty += 1
+                if page == 1 or consecutive_empty >= 2:  # Stop earlier for alphabet patterns
+                    break
+                continue
             
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
+            consecutive_empty = 0
+            hostnames.extend(record_hostnames(records))
             
-            # Respect the API's max_page if set
-            if max_page and page >= max_page:
-                print(f"Reached API max_page limit: {max_page}")
+            # Check meta info - stop at the last page instead of asking for an empty one
+            meta = data.get('meta', {})
+            if meta.get('max_page') and page >= meta.get('max_page'):
+                break
+            if meta.get('total_pages') is not None and page >= meta['total_pages']:
                 break
                 
         except Exception as e:
-            print(f"Standard API fallback error at page {page}: {e}")
+            logger.warning("Error with letter '%s', page %s: %s", letter_pattern, page, e)
             break
     
-    flash(f'Enhanced API (with fallback): Fetched {new_records} records', 'success')
+    return hostnames
 
 def fetch_reverse_records_bypass_limit(record_type, host):
     """Try various methods to bypass the 100-page limit with better duplicate prevention."""
@@ -594,203 +747,112 @@ def fetch_reverse_records_bypass_limit(record_type, host):
         flash('SecurityTrails API key not configured', 'error')
         return
     
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
     new_records = 0
-    fetched_domains = set()  # Track domains we've already seen
-    
-    print(f"Starting bypass methods for {record_type.upper()} host: {host}")
-    print("IMPORTANT: SecurityTrails has 100-page limits PER KEYWORD COMBINATION")
-    print("This means we can get 100 pages for each different filter pattern!")
-    
-    # Get existing domains to avoid duplicates
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    if record_type == 'mx':
-        cursor.execute('SELECT domain FROM domains WHERE mx = ?', (host,))
-    else:
-        cursor.execute('SELECT domain FROM domains WHERE ns = ?', (host,))
     
-    existing_domains = {row[0] for row in cursor.fetchall()}
-    conn.close()
+    logger.info("Starting bypass methods for %s host: %s", record_type.upper(), host)
+    logger.info("IMPORTANT: SecurityTrails has 100-page limits PER KEYWORD COMBINATION")
+    logger.info("This means we can get 100 pages for each different filter pattern!")
     
-    print(f"Found {len(existing_domains)} existing domains in database")
+    # Duplicates (including domains stored by earlier runs) are skipped by the unique index
+    buffer = DomainBuffer(record_type, host)
     
     # Method 1: Try larger page sizes first (most efficient)
-    print("=== Method 1: Larger page sizes (each gets its own 100-page limit) ===")
+    logger.info("=== Method 1: Larger page sizes (each gets its own 100-page limit) ===")
     for page_size in [500, 1000]:  # Focus on larger sizes
-        method_start_count = len(fetched_domains)
-        print(f"\\nTrying page size: {page_size} (can get up to {page_size * 100:,} records)")
+        method_start_count = new_records
+        logger.info(f"Trying page size: {page_size} (can get up to {page_size * 100:,} records)")
         
         consecutive_empty = 0
+        url = f"{API_BASE_URL}/domains/list"
+        page_body = domains_list_body({'mx' if record_type == 'mx' else 'ns': host}, limit=page_size)
         
         for page in range(1, 101):  # Full 100 pages
-            url = f"{API_BASE_URL}/domains/list"
-            
-            if record_type == 'mx':
-                filter_params = {'mx': host}
-            else:
-                filter_params = {'ns': host}
-            
-            request_body = {
-                'filter': filter_params,
-                'page': page,
-                'scroll': False,
-                'limit': page_size
-            }
-            
             try:
-                time.sleep(0.25)  # Respectful rate limiting
-                response = requests.post(url, headers=headers, json=request_body, timeout=30)
+                securitytrails_limiter.wait()
+                response = securitytrails_session.post(url, data=page_body(page), timeout=30)
                 
                 if response.status_code != 200:
-                    print(f"Page size {page_size}, page {page} failed: {response.status_code}")
+                    logger.warning("Page size %s, page %s failed: %s", page_size, page, response.status_code)
                     break
                 
-                data = response.json()
+                data = orjson.loads(response.content)
                 records = data.get('records', [])
                 
                 if not records:
                     consecutive_empty += 1
                     if consecutive_empty >= 3:
-                        print(f"Stopping at page {page} after {consecutive_empty} empty pages")
+                        logger.info("Stopping at page %s after %s empty pages", page, consecutive_empty)
                         break
                     continue
                 
                 consecutive_empty = 0
-                new_in_page = 0
                 
-                # Insert only new records
-                for record in records:
-                    domain = record.get('hostname', '')
-                    if domain and domain not in existing_domains and domain not in fetched_domains:
-                        fetched_domains.add(domain)
-                        if record_type == 'mx':
-                            insert_into_sqlite(domain, mx=host, ns=None)
-                        else:
-                            insert_into_sqlite(domain, mx=None, ns=host)
-                        new_records += 1
-                        new_in_page += 1
+                buffer.add(record_hostnames(records))
                 
-                if page % 10 == 0 or new_in_page > 0:  # Progress every 10 pages or when finding new records
-                    print(f"Page size {page_size}, page {page}: {len(records)} total, {new_in_page} new unique")
+                if page % 10 == 0:  # Progress every 10 pages
+                    logger.debug("Page size %s, page %s: %s total, %s new unique so far", page_size, page, len(records), buffer.inserted - method_start_count)
                 
                 # Check meta info
                 meta = data.get('meta', {})
                 if meta.get('max_page') and page >= meta.get('max_page'):
-                    print(f"Hit max_page limit ({meta.get('max_page')}) with size {page_size}")
+                    logger.info("Hit max_page limit (%s) with size %s", meta.get('max_page'), page_size)
                     break
                     
             except Exception as e:
-                print(f"Error with page size {page_size}, page {page}: {e}")
+                logger.warning("Error with page size %s, page %s: %s", page_size, page, e)
                 break
         
-        method_new = len(fetched_domains) - method_start_count
-        print(f"Page size {page_size} result: {method_new:,} new unique domains")
+        buffer.flush()
+        new_records = buffer.inserted
+        method_new = new_records - method_start_count
+        logger.info(f"Page size {page_size} result: {method_new:,} new unique domains")
         
         # Don't skip other sizes - each has its own limit!
         if method_new < 1000:  # Only skip if this size didn't work well
-            print(f"Page size {page_size} wasn't very effective, trying next size")
+            logger.info("Page size %s wasn't very effective, trying next size", page_size)
     
-    print(f"\\n=== Method 1 Summary: {len(fetched_domains):,} total unique domains ===")
+    logger.info(f"=== Method 1 Summary: {new_records:,} total unique domains ===")
     
     # Method 2: Alphabet-based segmentation (each letter gets 100 pages!)
-    print("\\n=== Method 2: Alphabet-based segmentation (each pattern gets 100 pages!) ===")
+    logger.info("=== Method 2: Alphabet-based segmentation (each pattern gets 100 pages!) ===")
     alphabet_patterns = ['a*', 'b*', 'c*', 'd*', 'e*', 'f*', 'g*', 'h*', 'i*', 'j*', 
                         'k*', 'l*', 'm*', 'n*', 'o*', 'p*', 'q*', 'r*', 's*', 't*', 
                         'u*', 'v*', 'w*', 'x*', 'y*', 'z*', '0*', '1*', '2*', '3*']
     
-    print(f"Trying {len(alphabet_patterns)} patterns × 100 pages = up to {len(alphabet_patterns) * 100 * 100:,} more records")
+    logger.info(f"Trying {len(alphabet_patterns)} patterns × 100 pages = up to {len(alphabet_patterns) * 100 * 100:,} more records")
     
     total_patterns_with_results = 0
     
-    for i, letter_pattern in enumerate(alphabet_patterns, 1):
-        method_start_count = len(fetched_domains)
-        pattern_records = 0
-        
-        consecutive_empty = 0
+    # Patterns are fetched concurrently under the shared rate limit; this thread
+    # stays the only one that dedupes and writes to SQLite
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=ALPHABET_WORKERS) as executor:
+        futures = {
+            executor.submit(fetch_hostname_pattern, record_type, host, letter_pattern, stop): (i, letter_pattern)
+            for i, letter_pattern in enumerate(alphabet_patterns, 1)
+        }
         
-        for page in range(1, 101):  # Full 100 pages per pattern
-            url = f"{API_BASE_URL}/domains/list"
-            
-            if record_type == 'mx':
-                filter_params = {
-                    'mx': host,
-                    'hostname': letter_pattern
-                }
-            else:
-                filter_params = {
-                    'ns': host,
-                    'hostname': letter_pattern
-                }
-            
-            request_body = {
-                'filter': filter_params,
-                'page': page,
-                'scroll': False
-            }
+        for future in as_completed(futures):
+            i, letter_pattern = futures[future]
+            buffer.add(future.result())
+            buffer.flush()
+            method_new = buffer.inserted - new_records
+            new_records = buffer.inserted
+            if method_new > 0:
+                total_patterns_with_results += 1
+                logger.info(f"Pattern '{letter_pattern}' ({i}/{len(alphabet_patterns)}): {method_new:,} new unique domains")
             
-            try:
-                time.sleep(0.2)
-                response = requests.post(url, headers=headers, json=request_body, timeout=30)
-                
-                if response.status_code != 200:
-                    break
-                
-                data = response.json()
-                records = data.get('records', [])
-                
-                if not records:
-                    consecutive_empty += 1
-                    if consecutive_empty >= 2:  # Stop earlier for alphabet patterns
-                        break
-                    continue
-                
-                consecutive_empty = 0
-                new_in_page = 0
-                
-                # Insert only new records
-                for record in records:
-                    domain = record.get('hostname', '')
-                    if domain and domain not in existing_domains and domain not in fetched_domains:
-                        fetched_domains.add(domain)
-                        if record_type == 'mx':
-                            insert_into_sqlite(domain, mx=host, ns=None)
-                        else:
-                            insert_into_sqlite(domain, mx=None, ns=host)
-                        new_records += 1
-                        new_in_page += 1
-                        pattern_records += 1
-                
-                # Check meta info
-                meta = data.get('meta', {})
-                if meta.get('max_page') and page >= meta.get('max_page'):
-                    break
-                    
-            except Exception as e:
-                print(f"Error with letter '{letter_pattern}', page {page}: {e}")
-                break
-        
-        method_new = len(fetched_domains) - method_start_count
-        if method_new > 0:
-            total_patterns_with_results += 1
-            print(f"Pattern '{letter_pattern}' ({i}/{len(alphabet_patterns)}): {method_new:,} new unique domains")
-        
-        # Stop if we've collected a huge amount
-        if len(fetched_domains) > 500000:
-            print(f"Reached {len(fetched_domains):,} domains, stopping alphabet method")
-            break
+            # Stop if we've collected a huge amount
+            if new_records > 500000 and not stop.is_set():
+                logger.info(f"Reached {new_records:,} domains, stopping alphabet method")
+                stop.set()
     
-    print(f"\\nAlphabet method: {total_patterns_with_results}/{len(alphabet_patterns)} patterns had results")
+    logger.info("Alphabet method: %s/%s patterns had results", total_patterns_with_results, len(alphabet_patterns))
     
-    print(f"=== Final Summary ===")
-    print(f"Total unique domains fetched: {len(fetched_domains)}")
-    print(f"New records added to database: {new_records}")
+    logger.info("=== Final Summary ===")
+    logger.info("New records added to database: %s", new_records)
     
-    flash(f'Bypass methods fetched {new_records} NEW unique records (avoided {len(fetched_domains) - new_records} duplicates)', 'success')
+    flash(f'Bypass methods fetched {new_records} NEW unique records', 'success')
 
 def fetch_reverse_records(record_type, host):
     """Original standard API method."""
@@ -798,128 +860,32 @@ def fetch_reverse_records(record_type, host):
         flash('SecurityTrails API key not configured', 'error')
         return
     
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
     page = 1
-    new_records = 0
+    buffer = DomainBuffer(record_type, host)
     
-    while True:
-        # Use the correct SecurityTrails API endpoint
-        url = f"{API_BASE_URL}/domains/list"
-        
-        # Construct filter based on record type
-        if record_type == 'mx':
-            filter_params = {'mx': host}
-        else:  # ns
-            filter_params = {'ns': host}
-        
-        request_body = {
-            'filter': filter_params,
-            'page': page,
-            'scroll': False
-        }
-        
-        try:
-            # Rate limiting: 5 requests per second = 0.2 seconds between requests
-            time.sleep(0.2)
-            
-            response = requests.post(url, headers=headers, json=request_body, timeout=30)
-            
-            if response.status_code != 200:
-                error_msg = f'API Error: {response.status_code} - {response.text}'
-                flash(error_msg, 'error')
-                break
-            
-            data = response.json()
-            records = data.get('records', [])
-            
-            if not records:
-                break
-            
-            # Insert records into SQLite
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:  # ns
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
-            
-            page += 1
-            
-            # Check if we've reached the end - SecurityTrails typically returns fewer results on last page
-            # Also check for meta information about pagination
-            meta = data.get('meta', {})
-            if len(records) == 0 or (meta.get('max_page') and page > meta.get('max_page')):
-                break
-                
-        except requests.RequestException as e:
-            flash(f'Network error: {str(e)}', 'error')
-            break
-        except Exception as e:
-            flash(f'Error fetching data: {str(e)}', 'error')
-            break
-    
-    flash(f'Fetched {new_records} new records for {record_type.upper()} host: {host}', 'success')
-    """Fetch reverse records from SecurityTrails API with pagination."""
-    if not API_KEY:
-        flash('SecurityTrails API key not configured', 'error')
-        return
-    
-    headers = {
-        'APIKEY': API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    page = 1
-    new_records = 0
+    # Use the correct SecurityTrails API endpoint
+    url = f"{API_BASE_URL}/domains/list"
+    page_body = domains_list_body({'mx' if record_type == 'mx' else 'ns': host})
     
     while True:
-        # Use the correct SecurityTrails API endpoint
-        url = f"{API_BASE_URL}/domains/list"
-        
-        # Construct filter based on record type
-        if record_type == 'mx':
-            filter_params = {'mx': host}
-        else:  # ns
-            filter_params = {'ns': host}
-        
-        request_body = {
-            'filter': filter_params,
-            'page': page,
-            'scroll': False
-        }
-        
         try:
-            # Rate limiting: 5 requests per second = 0.2 seconds between requests
-            time.sleep(0.2)
+            securitytrails_limiter.wait()
             
-            response = requests.post(url, headers=headers, json=request_body, timeout=30)
+            response = securitytrails_session.post(url, data=page_body(page), timeout=30)
             
             if response.status_code != 200:
                 error_msg = f'API Error: {response.status_code} - {response.text}'
                 flash(error_msg, 'error')
                 break
             
-            data = response.json()
+            data = orjson.loads(response.content)
             records = data.get('records', [])
             
             if not records:
                 break
             
             # Insert records into SQLite
-            for record in records:
-                domain = record.get('hostname', '')
-                if domain:
-                    if record_type == 'mx':
-                        insert_into_sqlite(domain, mx=host, ns=None)
-                    else:  # ns
-                        insert_into_sqlite(domain, mx=None, ns=host)
-                    new_records += 1
+            buffer.add(record_hostnames(records))
             
             page += 1
             
@@ -936,7 +902,8 @@ def fetch_reverse_records(record_type, host):
             flash(f'Error fetching data: {str(e)}', 'error')
             break
     
-    flash(f'Fetched {new_records} new records for {record_type.upper()} host: {host}', 'success')
+    buffer.flush()
+    flash(f'Fetched {buffer.inserted} new records for {record_type.upper()} host: {host}', 'success')
 
 @app.route('/')
 def home():
@@ -958,6 +925,7 @@ def results():
         use_scroll = request.args.get('use_scroll') == 'true'
     
     page = int(request.args.get('page', 1))
+    after = request.args.get('after')
     
     if not record_type or not host:
         flash('Please provide both record type and host', 'error')
@@ -971,20 +939,26 @@ def results():
     
     # Check cache and fetch if needed
     if not check_cache(record_type, host) or refresh:
-        if use_scroll:
-            flash('Fetching unlimited data using DSL + Scroll API...', 'info')
-            fetch_reverse_records_with_scroll(record_type, host)
-        else:
-            bypass_limit = request.form.get('bypass_limit') == 'on' or request.args.get('bypass_limit') == 'true'
-            if bypass_limit:
-                flash('Trying bypass methods to get more than 10,000 results...', 'info')
-                fetch_reverse_records_bypass_limit(record_type, host)
+        # Requests for the same host queue behind one fetch, and find its results fresh
+        with host_fetch_lock(record_type, host):
+            if fetched_recently(record_type, host):
+                flash('This host was fetched moments ago - showing those results', 'info')
+            elif use_scroll:
+                flash('Fetching unlimited data using DSL + Scroll API...', 'info')
+                fetch_reverse_records_with_scroll(record_type, host)
+                mark_fetched(record_type, host)
             else:
-                flash('Fetching data from SecurityTrails API (up to 10,000 results)...', 'info')
-                fetch_reverse_records(record_type, host)
+                bypass_limit = request.form.get('bypass_limit') == 'on' or request.args.get('bypass_limit') == 'true'
+                if bypass_limit:
+                    flash('Trying bypass methods to get more than 10,000 results...', 'info')
+                    fetch_reverse_records_bypass_limit(record_type, host)
+                else:
+                    flash('Fetching data from SecurityTrails API (up to 10,000 results)...', 'info')
+                    fetch_reverse_records(record_type, host)
+                mark_fetched(record_type, host)
     
     # Get paginated results
-    records, total_count = query_sqlite(record_type, host, page)
+    records, total_count, next_cursor = query_sqlite(record_type, host, page, after=after)
     
     # Calculate pagination info
     per_page = 50
@@ -1000,12 +974,13 @@ def results():
                          total_pages=total_pages,
                          total_count=total_count,
                          has_prev=has_prev,
-                         has_next=has_next)
+                         has_next=has_next,
+                         next_cursor=next_cursor)
 
 @app.route('/test-api')
 def test_api():
     """Test API endpoint for debugging."""
-    success, message = test_api_connection()
+    success, message = test_api_connection(use_cache=False)
     if success:
         flash(f'✅ {message}', 'success')
     else:
@@ -1014,35 +989,37 @@ def test_api():
 
 @app.route('/export/<record_type>/<host>')
 def export_csv(record_type, host):
-    """Export all results to CSV."""
+    """Export all results to CSV, streamed as rows come off the cursor."""
     records = query_all_sqlite(record_type, host)
     
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write headers
-    writer.writerow(['Domain', 'MX', 'NS', 'Fetched At'])
-    
-    # Write data
-    for record in records:
-        writer.writerow(record)
-    
-    # Prepare file for download
-    output.seek(0)
-    
-    # Create BytesIO for Flask send_file
-    mem = io.BytesIO()
-    mem.write(output.getvalue().encode('utf-8'))
-    mem.seek(0)
+    def generate():
+        # csv writes text straight into a bytes buffer - chunks go out already encoded
+        output = io.BytesIO()
+        writer = csv.writer(io.TextIOWrapper(output, encoding='utf-8', newline='', write_through=True))
+        
+        # Write headers
+        writer.writerow(['Domain', 'MX', 'NS', 'Fetched At'])
+        
+        # Write data one fetch at a time
+        while True:
+            rows = records.fetchmany()
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+        
+        # Headers only when there were no rows
+        if output.tell():
+            yield output.getvalue()
     
     filename = f"{record_type}_{host}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    return send_file(
-        mem,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='text/csv'
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 if __name__ == '__main__':
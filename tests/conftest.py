@@ -0,0 +1,21 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the app at a fresh DuckDB file with the schema created, and return this thread's cursor."""
+    monkeypatch.setattr(app, 'DATABASE', str(tmp_path / 'domains.duckdb'))
+    monkeypatch.setattr(app, '_db_conn', None)
+    monkeypatch.setattr(app, '_db_local', threading.local())
+    # The session writer keeps the cursor it opened first, so each test gets its own
+    monkeypatch.setattr(app, 'session_writer', app.SessionUpdateWriter())
+    app.init_db()
+    return app.get_db()
@@ -0,0 +1,174 @@
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+
+import app
+
+
+def session_row(db, session_id):
+    return db.execute(
+        "SELECT server, record_type, provider, status, total_domains, pages_fetched, completed_at "
+        "FROM harvest_sessions WHERE id = ?",
+        (session_id,)
+    ).fetchone()
+
+
+def test_create_harvest_session_inserts_running_row(db):
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    
+    server, record_type, provider, status, total_domains, pages_fetched, completed_at = session_row(db, session_id)
+    assert (server, record_type, provider, status) == ('mx.example.com', 'mx', 'viewdns', 'running')
+    assert (total_domains, pages_fetched, completed_at) == (0, 0, None)
+
+
+def test_write_harvest_session_applies_parameterized_update(db):
+    session_id = app.create_harvest_session('ns.example.com', 'ns')
+    
+    app.write_harvest_session(db, session_id, {'pages_fetched': 3, 'total_domains': 120})
+    assert session_row(db, session_id)[3:6] == ('running', 120, 3)
+    
+    app.write_harvest_session(db, session_id, {'status': 'complete', 'total_domains': 150})
+    row = session_row(db, session_id)
+    assert row[3:6] == ('complete', 150, 3)
+    assert row[6] is not None
+
+
+def test_init_db_drops_status_index_so_status_updates_persist(db):
+    # Databases created before the fix still carry the index on status
+    db.execute("CREATE INDEX idx_harvest_status ON harvest_sessions(status)")
+    app.init_db()
+    
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    app.write_harvest_session(db, session_id, {'status': 'error'})
+    
+    assert session_row(db, session_id)[3] == 'error'
+
+
+def test_session_writer_flushes_queued_updates(db):
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    
+    app.update_harvest_session(session_id, pages_fetched=1, total_domains=10)
+    app.update_harvest_session(session_id, pages_fetched=2, total_domains=25)
+    app.session_writer.flush()
+    
+    assert session_row(db, session_id)[4:6] == (25, 2)
+
+
+def test_maintenance_refused_while_a_harvest_runs(db, monkeypatch):
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    assert app.insert_domains_batch(['a.example', 'b.example'], 'mx', 'mx.example.com', session_id) == 2
+    
+    release = threading.Event()
+    harvest = threading.Thread(target=release.wait, daemon=True)
+    harvest.start()
+    monkeypatch.setattr(app, 'harvest_threads', {session_id: harvest})
+    try:
+        assert app.maintain_domains_storage() is False
+    finally:
+        release.set()
+        harvest.join()
+    
+    assert app.maintain_domains_storage() is True
+    assert app.get_db().execute("SELECT COUNT(*) FROM domains").fetchone()[0] == 2
+
+
+class FailingCommitCursor:
+    """Cursor wrapper whose COMMIT statements fail, to force a lost transaction."""
+    
+    def __init__(self, cursor):
+        self.cursor = cursor
+    
+    def execute(self, sql, *args):
+        if sql.strip().upper() == 'COMMIT':
+            raise RuntimeError('forced commit failure')
+        return self.cursor.execute(sql, *args)
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def test_commit_failure_marks_harvest_as_error(db, monkeypatch):
+    real_get_db = app.get_db
+    monkeypatch.setattr(app, 'get_db', lambda: FailingCommitCursor(real_get_db()))
+    monkeypatch.setattr(app, 'VIEWDNS_API_KEY', 'test-key')
+    monkeypatch.setattr(app, 'harvest_threads', {})
+    monkeypatch.setattr(
+        app.ViewDNSAPI, 'fetch_page',
+        lambda self, record_type, server, page: {'domains': ['a.example', 'b.example']}
+    )
+    
+    response = app.app.test_client().post(
+        '/harvest', data={'record_type': 'mx', 'server': 'mx.example.com', 'max_pages': '1'}
+    )
+    assert response.status_code == 302
+    
+    (session_id, harvest), = app.harvest_threads.items()
+    harvest.join(timeout=30)
+    assert not harvest.is_alive()
+    app.session_writer.flush()
+    
+    assert session_row(db, session_id)[3] == 'error'
+    # Nothing from the rolled-back page group is stored or counted
+    assert db.execute("SELECT COUNT(*) FROM domains").fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM unique_domains").fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM server_counts").fetchone()[0] == 0
+
+
+def test_finish_harvest_persists_progress_and_status(db, monkeypatch):
+    monkeypatch.setattr(app, 'harvest_progress', OrderedDict())
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    app.set_harvest_progress(session_id, page=3, total_domains=42, server='mx.example.com', record_type='mx')
+    
+    app.finish_harvest(session_id, 'complete')
+    
+    row = session_row(db, session_id)
+    assert row[3:6] == ('complete', 42, 3)
+    assert row[6] is not None
+
+
+def test_clear_database_refused_while_a_harvest_runs(db, monkeypatch):
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    app.insert_domains_batch(['a.example'], 'mx', 'mx.example.com', session_id)
+    
+    release = threading.Event()
+    harvest = threading.Thread(target=release.wait, daemon=True)
+    harvest.start()
+    monkeypatch.setattr(app, 'harvest_threads', {session_id: harvest})
+    client = app.app.test_client()
+    try:
+        assert client.post('/clear-database').status_code == 409
+        assert session_id in app.harvest_threads
+    finally:
+        release.set()
+        harvest.join()
+    
+    response = client.post('/clear-database')
+    assert response.status_code == 200
+    assert response.get_json()['domains_removed'] == 1
+    assert app.harvest_threads == {}
+
+
+def test_excel_export_writes_domains_as_plain_strings(db):
+    session_id = app.create_harvest_session('mx.example.com', 'mx')
+    app.insert_domains_batch(['a.example', 'b.example'], 'mx', 'mx.example.com', session_id)
+    
+    response = app.app.test_client().get('/export?type=mx&server=mx.example.com&format=excel')
+    assert response.status_code == 200
+    
+    with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        strings = workbook.read('xl/sharedStrings.xml').decode() if 'xl/sharedStrings.xml' in workbook.namelist() else sheet
+    assert '<hyperlink' not in sheet
+    assert 'http://a.example' in strings
+
+
+def test_init_db_drops_leftover_export_staging_tables(db):
+    table_name = f"{app.EXPORT_ROWS_PREFIX}leftover"
+    app.stage_export_rows(db, '1=1', [], table_name)
+    
+    app.init_db()
+    
+    assert db.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", (table_name,)
+    ).fetchone()[0] == 0